@@ -1,60 +1,86 @@
 from img_util import *
-from sklearn.preprocessing import LabelBinarizer
 import numpy as np
-import pickle
 import math
-import random
-import tensorflow as tf
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from glove_interface import *
+from data_context import context
 
-random.seed(0)
 np.random.seed(0)
 
 NUM_CHANNELS = 3
+PREFETCH_DEPTH = 4
+PREFETCH_WORKERS = 2
 
-print('LOADING DATA')
-target_train_data = pickle.load(open('pickle_files/target_train_data.pickle', 'rb'))
-target_test_data = pickle.load(open('pickle_files/target_test_data.pickle', 'rb'))
-not_target_train_data = pickle.load(open('pickle_files/not_target_train_data.pickle', 'rb'))
-not_target_test_data = pickle.load(open('pickle_files/not_target_test_data.pickle', 'rb'))
 
-vectorizer = pickle.load(open('pickle_files/vectorizer.pickle', 'rb'))
-print('DATA LOADED')
-
-
-def adjust_data(image_array, image_size):
+def adjust_data(image_matrix, image_size):
     """Resize the image to the needs of the model"""
-    image_matrix = image_array_to_image_matrix(image_array)
     resized_image = resize_image_matrix(image_matrix, image_size, image_size)
     return resized_image
 
 
+def adjust_batch(image_batch, image_size):
+    """Resize a whole (batch, height, width, channels) image batch to the needs of the model"""
+    if np.shape(image_batch)[1:3] == (image_size, image_size):
+        return np.asarray(image_batch)
+    return resize_image_batch(image_batch, image_size, image_size)
+
+
 def word2vec_batch(word_batch):
     """Takes a word batch and convert it to a dense representation batch"""
-    new_batch = []
-    for word in word_batch:
-        wv = find_word_vec(normalize_label(word))
-        new_batch.append(wv)
-    return new_batch
+    return context.label_embeddings.vectors(word_batch)
+
+
+def make_batch(data, batch_indices, image_size, word2vec=False, send_raw_str=False):
+    """Builds the batch with the selected samples of a columnar dataset"""
+    Xs = adjust_batch(data.images[batch_indices], image_size)
+
+    raw_Ys = data.fine_names(batch_indices).tolist()
+    if not word2vec:
+        Ys = context.vectorizer.transform(raw_Ys)
+    else:
+        Ys = word2vec_batch(raw_Ys)
+
+    if not send_raw_str:
+        return [Xs, Ys]
+    else:
+        return [Xs, Ys, raw_Ys]
+
+
+def split_in_batches(len_data, size_batch):
+    """Shuffles the sample indices and splits them in batches (the last one may be smaller)"""
+    order = np.random.permutation(len_data)
+    num_batches = math.ceil(len_data / size_batch)
+    return [order[i * size_batch:min(len_data, (i + 1) * size_batch)] for i in range(num_batches)]
+
+
+def label_embedding_rows(data):
+    """Returns, for every sample of a columnar dataset, the row of its label in the label embedding table"""
+    return context.label_embeddings.rows(data.fine_label_names)[data.fine_labels]
 
 
 def get_batches(data, size_batch, image_size, word2vec=False, send_raw_str=False):
-    """Takes a batch of pairs (image, word2vec word) and creates data generators from it"""
-    random.shuffle(target_train_data)
-    len_data = len(data)
-    num_batches = math.floor(len_data / size_batch)
-    for i in range(num_batches):
-        new_batch = data[i * size_batch:min(len_data, (i + 1) * size_batch)]
-        Xs = [adjust_data(b[0], image_size) for b in new_batch]
-
-        raw_Ys = [b[1] for b in new_batch]
-        if not word2vec:
-            Ys = vectorizer.transform(raw_Ys)
-        else:
-            Ys = word2vec_batch(raw_Ys)
-
-        if not send_raw_str:
-            yield [Xs, Ys]
-        else:
-            yield [Xs, Ys, raw_Ys]
+    """Takes a columnar dataset of (image, label) pairs and creates data generators from it"""
+    for batch_indices in split_in_batches(len(data), size_batch):
+        yield make_batch(data, batch_indices, image_size, word2vec, send_raw_str)
+
+
+def prefetch_batches(data, size_batch, image_size, word2vec=False, send_raw_str=False,
+                     depth=PREFETCH_DEPTH, num_workers=PREFETCH_WORKERS):
+    """Same as get_batches, but up to depth batches are built ahead by background threads
+    while the model runs on the current one"""
+    executor = ThreadPoolExecutor(max_workers=num_workers)
+    pending = deque()
+    try:
+        for batch_indices in split_in_batches(len(data), size_batch):
+            pending.append(executor.submit(make_batch, data, batch_indices, image_size, word2vec, send_raw_str))
+            if len(pending) > depth:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # Generator closed before the end of the epoch: drop the batches not started yet
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
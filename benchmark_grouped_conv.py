@@ -0,0 +1,69 @@
+# Benchmark of the grouped convolution implementations of models.conv (models.GROUPED_CONV).
+# The AlexNet composite model is built with each implementation from the same checkpoint,
+# the outputs and gradients are compared and the inference and training step times reported.
+import argparse
+import os
+import tempfile
+import numpy as np
+import tensorflow as tf
+import models
+from benchmark_losses import time_op
+
+IMPLEMENTATIONS = ['split', 'block_diagonal']
+IMAGE_SIZE = 24
+num_classes = 60
+word2vec_size = 200
+
+
+def build_step(implementation, images, targets):
+    """Builds the composite model with a grouped conv implementation. Returns the projection,
+    the gradients of a squared error loss and a training op"""
+    models.GROUPED_CONV = implementation
+    x = tf.constant(images)
+    model = models.Composite_model(x, num_classes, word2vec_size, with_classifier=False)
+    loss = tf.reduce_mean(tf.reduce_sum(tf.square(model.projection_layer - targets), axis=1))
+    optimizer = tf.train.MomentumOptimizer(0.001, 0.9)
+    grads_and_vars = optimizer.compute_gradients(loss)
+    train_op = optimizer.apply_gradients(grads_and_vars)
+    return model.projection_layer, [g for g, v in grads_and_vars], train_op
+
+
+def benchmark_implementation(implementation, images, targets, check_point_file, num_steps):
+    """Restores the shared checkpoint into the model built with an implementation and times its steps"""
+    graph = tf.Graph()
+    with graph.as_default():
+        output, gradients, train_op = build_step(implementation, images, targets)
+        saver = tf.train.Saver(tf.trainable_variables())
+        with tf.Session(graph=graph) as sess:
+            sess.run(tf.global_variables_initializer())
+            if os.path.exists(check_point_file + '.index'):
+                saver.restore(sess, check_point_file)
+            else:
+                saver.save(sess, check_point_file)
+            values = sess.run([output] + gradients)
+            inference_time = time_op(sess, output, num_steps)
+            train_time = time_op(sess, train_op, num_steps)
+    return values, inference_time, train_time
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the grouped convolution implementations')
+    parser.add_argument('--batch-size', type=int, default=128)
+    parser.add_argument('--steps', type=int, default=50)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    images = rng.randint(0, 256, (args.batch_size, IMAGE_SIZE, IMAGE_SIZE, 3)).astype(np.float32)
+    targets = rng.normal(size=(args.batch_size, word2vec_size)).astype(np.float32) / 10
+    check_point_file = os.path.join(tempfile.mkdtemp(), 'model.ckpt')
+
+    results = {}
+    print('%-16s %16s %16s' % ('implementation', 'inference (ms)', 'train step (ms)'))
+    for implementation in IMPLEMENTATIONS:
+        values, inference_time, train_time = benchmark_implementation(implementation, images, targets,
+                                                                      check_point_file, args.steps)
+        results[implementation] = values
+        print('%-16s %16.2f %16.2f' % (implementation, 1000 * inference_time, 1000 * train_time))
+
+    differences = [np.max(np.abs(a - b)) for a, b in zip(results['split'], results['block_diagonal'])]
+    print('Max difference of the outputs %g and gradients %g' % (differences[0], max(differences[1:])))
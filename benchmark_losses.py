@@ -0,0 +1,89 @@
+# Benchmark of the loss functions registered in losses.LOSS_BUILDERS.
+# Every loss is built on the same synthetic batch (random image features projected by a
+# trainable 'proj' layer and random label embeddings) and the graph build time,
+# forward/backward step times and peak memory are reported.
+import argparse
+import time
+import numpy as np
+import tensorflow as tf
+from models import fc
+from data_context import context
+from label_embeddings import LabelEmbeddings
+from losses import *
+
+FEATURES_SIZE = 192
+
+
+def use_synthetic_labels(num_labels, rng):
+    """Replaces the label embedding table of the data context by a random one"""
+    labels = ['label_%d' % i for i in range(num_labels)]
+    matrix = rng.normal(size=(num_labels, word2vec_size)).astype(np.float32) / 10
+    context.cached('all_labels', lambda: labels)
+    context.cached('label_embeddings', lambda: LabelEmbeddings(labels, matrix))
+
+
+def peak_memory(run_metadata):
+    """Largest allocator peak (in bytes) recorded in a traced step"""
+    peak = 0
+    for device_stats in run_metadata.step_stats.dev_stats:
+        for node_stats in device_stats.node_stats:
+            for memory in node_stats.memory:
+                peak = max(peak, memory.peak_bytes)
+    return peak
+
+
+def time_op(sess, op, num_steps):
+    """Mean time in seconds of a sess.run(op)"""
+    sess.run(op)
+    start = time.time()
+    for i in range(num_steps):
+        sess.run(op)
+    return (time.time() - start) / num_steps
+
+
+def benchmark_loss(name, features, targets, use_reg, num_steps):
+    """Builds a loss in a new graph and measures its costs"""
+    graph = tf.Graph()
+    with graph.as_default():
+        start = time.time()
+        model_output = fc(tf.constant(features), FEATURES_SIZE, word2vec_size, name='proj', relu=False)
+        loss = build_loss(name, model_output, tf.constant(targets), use_reg=use_reg)
+        train_op = tf.train.MomentumOptimizer(0.01, 0.9).minimize(loss)
+        build_time = time.time() - start
+        num_nodes = len(graph.as_graph_def().node)
+
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            forward_time = time_op(sess, loss, num_steps)
+            train_time = time_op(sess, train_op, num_steps)
+
+            run_metadata = tf.RunMetadata()
+            sess.run(train_op, options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE),
+                     run_metadata=run_metadata)
+
+    return {'build_time': build_time, 'num_nodes': num_nodes, 'forward_time': forward_time,
+            'train_time': train_time, 'peak_memory': peak_memory(run_metadata)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the registered loss functions')
+    parser.add_argument('--losses', nargs='+', default=sorted(LOSS_BUILDERS.keys()),
+                        choices=sorted(LOSS_BUILDERS.keys()))
+    parser.add_argument('--batch-size', type=int, default=128)
+    parser.add_argument('--num-labels', type=int, default=100)
+    parser.add_argument('--steps', type=int, default=50)
+    parser.add_argument('--use-reg', action='store_true')
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    use_synthetic_labels(args.num_labels, rng)
+    features = rng.normal(size=(args.batch_size, FEATURES_SIZE)).astype(np.float32)
+    targets = rng.normal(size=(args.batch_size, word2vec_size)).astype(np.float32) / 10
+
+    print('%-16s %10s %8s %12s %12s %12s' % ('loss', 'build (s)', 'nodes', 'forward (ms)', 'step (ms)',
+                                              'peak (MB)'))
+    for name in args.losses:
+        r = benchmark_loss(name, features, targets, args.use_reg, args.steps)
+        print('%-16s %10.3f %8d %12.2f %12.2f %12.2f' % (name, r['build_time'], r['num_nodes'],
+                                                         1000 * r['forward_time'], 1000 * r['train_time'],
+                                                         r['peak_memory'] / 2.0 ** 20))
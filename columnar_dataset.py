@@ -0,0 +1,133 @@
+import json
+import numpy as np
+import os
+import shutil
+import tempfile
+from img_util import resize_image_batch
+
+SIGNATURE_FILE = 'source_signature.json'
+RESIZE_CHUNK_SIZE = 1024
+
+COLUMNS = ['images', 'fine_labels', 'coarse_labels', 'fine_label_names', 'coarse_label_names']
+
+
+class ColumnarDataset(object):
+    """A dataset stored as contiguous arrays: uint8 images (N, 32, 32, 3) in HWC layout,
+    integer fine/coarse labels and the tables with the label names"""
+    def __init__(self, images, fine_labels, coarse_labels, fine_label_names, coarse_label_names):
+        self.images = images
+        self.fine_labels = fine_labels
+        self.coarse_labels = coarse_labels
+        self.fine_label_names = np.asarray(fine_label_names)
+        self.coarse_label_names = np.asarray(coarse_label_names)
+
+    def __len__(self):
+        return len(self.fine_labels)
+
+    def __getitem__(self, index):
+        """Returns the subset of the dataset selected by a slice or an index array"""
+        return ColumnarDataset(self.images[index], self.fine_labels[index], self.coarse_labels[index],
+                               self.fine_label_names, self.coarse_label_names)
+
+    def __add__(self, other):
+        return concatenate_datasets([self, other])
+
+    def fine_names(self, index=slice(None)):
+        """Returns the fine label names of the selected samples"""
+        return self.fine_label_names[self.fine_labels[index]]
+
+    def coarse_names(self, index=slice(None)):
+        """Returns the coarse label names of the selected samples"""
+        return self.coarse_label_names[self.coarse_labels[index]]
+
+
+def concatenate_datasets(datasets):
+    """Concatenates datasets that share the same label name tables"""
+    if len(datasets) == 0:
+        raise ValueError("At least one dataset is needed to be concatenated")
+    for d in datasets[1:]:
+        if not (np.array_equal(d.fine_label_names, datasets[0].fine_label_names) and
+                np.array_equal(d.coarse_label_names, datasets[0].coarse_label_names)):
+            raise ValueError("Datasets should have the same label names to be concatenated")
+
+    return ColumnarDataset(np.concatenate([d.images for d in datasets]),
+                           np.concatenate([d.fine_labels for d in datasets]),
+                           np.concatenate([d.coarse_labels for d in datasets]),
+                           datasets[0].fine_label_names, datasets[0].coarse_label_names)
+
+
+def save_columnar_dataset(dataset, folder):
+    """Saves every column of the dataset as a .npy file inside folder"""
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    for column in COLUMNS:
+        np.save(os.path.join(folder, column + '.npy'), np.ascontiguousarray(getattr(dataset, column)))
+
+
+def load_columnar_dataset(folder, mmap_mode='r'):
+    """Loads a dataset saved by save_columnar_dataset. The arrays are memory mapped by default"""
+    columns = [np.load(os.path.join(folder, column + '.npy'), mmap_mode=mmap_mode) for column in COLUMNS]
+    return ColumnarDataset(*columns)
+
+
+def source_signature(folder):
+    """Size and modification time of every column file, used to detect changes in a dataset"""
+    signature = {}
+    for column in COLUMNS:
+        stat = os.stat(os.path.join(folder, column + '.npy'))
+        signature[column] = [stat.st_size, stat.st_mtime_ns]
+    return signature
+
+
+def build_resized_dataset(source_folder, cache_folder, image_size):
+    """Resizes the images of a saved dataset once and saves the result as a new columnar dataset.
+    The dataset is written into a temporary folder that replaces cache_folder once complete,
+    so an interrupted or concurrent build never leaves a partial cache"""
+    source = load_columnar_dataset(source_folder)
+    cache_folder = os.path.abspath(cache_folder)
+    if not os.path.isdir(os.path.dirname(cache_folder)):
+        os.makedirs(os.path.dirname(cache_folder))
+    build_folder = tempfile.mkdtemp(prefix=os.path.basename(cache_folder) + '.', dir=os.path.dirname(cache_folder))
+
+    try:
+        images = np.lib.format.open_memmap(os.path.join(build_folder, 'images.npy'), mode='w+', dtype=np.uint8,
+                                           shape=(len(source), image_size, image_size, source.images.shape[3]))
+        for i in range(0, len(source), RESIZE_CHUNK_SIZE):
+            images[i:i + RESIZE_CHUNK_SIZE] = resize_image_batch(source.images[i:i + RESIZE_CHUNK_SIZE],
+                                                                 image_size, image_size)
+        images.flush()
+        del images
+
+        for column in COLUMNS[1:]:
+            np.save(os.path.join(build_folder, column + '.npy'), getattr(source, column))
+
+        with open(os.path.join(build_folder, SIGNATURE_FILE), 'w') as f:
+            json.dump(source_signature(source_folder), f)
+
+        if os.path.isdir(cache_folder):
+            shutil.rmtree(cache_folder, ignore_errors=True)
+        try:
+            os.replace(build_folder, cache_folder)
+        except OSError:
+            # Another process put its cache of the same source in place first
+            if not os.path.isfile(os.path.join(cache_folder, SIGNATURE_FILE)):
+                raise
+    finally:
+        if os.path.isdir(build_folder):
+            shutil.rmtree(build_folder)
+
+
+def load_resized_dataset(source_folder, cache_folder, image_size):
+    """Memory maps the dataset with images resized to image_size, (re)building the cache
+    when it does not exist or the source dataset changed"""
+    signature_file = os.path.join(cache_folder, SIGNATURE_FILE)
+    cached_signature = None
+    if os.path.isfile(signature_file):
+        with open(signature_file) as f:
+            cached_signature = json.load(f)
+
+    if cached_signature != source_signature(source_folder):
+        print('BUILDING RESIZED CACHE', cache_folder)
+        build_resized_dataset(source_folder, cache_folder, image_size)
+
+    return load_columnar_dataset(cache_folder)
@@ -0,0 +1,107 @@
+import os
+import pickle
+import threading
+
+from glove_interface import get_glove
+from label_embeddings import *
+from columnar_dataset import load_columnar_dataset, load_resized_dataset
+
+# Folder written by read_cifar100, can be changed with the PICKLE_FOLDER environment variable
+PICKLE_FOLDER = os.environ.get('PICKLE_FOLDER', 'pickle_files')
+
+
+class DataContext(object):
+    """Datasets and embeddings loaded on first access and kept for the whole process,
+    so importing a module costs nothing and each script only loads what it uses"""
+    def __init__(self, pickle_folder=PICKLE_FOLDER):
+        self.pickle_folder = pickle_folder
+        self._cache = {}
+        self._lock = threading.RLock()
+
+    def set_pickle_folder(self, pickle_folder):
+        """Switches to the datasets of another folder, dropping everything loaded from the current one"""
+        with self._lock:
+            self.pickle_folder = pickle_folder
+            self._cache = {}
+
+    def cached(self, name, builder):
+        """Returns the object stored under name, building it on the first access"""
+        with self._lock:
+            if name not in self._cache:
+                self._cache[name] = builder()
+            return self._cache[name]
+
+    def load_pickle(self, name):
+        """Loads (once) a pickle file from the pickle folder"""
+        def load():
+            print('LOADING', name)
+            with open(os.path.join(self.pickle_folder, name + '.pickle'), 'rb') as f:
+                return pickle.load(f)
+        return self.cached(name, load)
+
+    def load_dataset(self, name):
+        """Memory maps (once) a columnar dataset from the pickle folder"""
+        return self.cached(name, lambda: load_columnar_dataset(os.path.join(self.pickle_folder, name)))
+
+    def resized_dataset(self, name, image_size):
+        """Memory maps (once) a dataset with its images already resized to image_size.
+        The resized images are cached on disk and rebuilt when the source dataset changes"""
+        def load():
+            source_folder = os.path.join(self.pickle_folder, name)
+            cache_folder = os.path.join(self.pickle_folder, 'resized_%d' % image_size, name)
+            return load_resized_dataset(source_folder, cache_folder, image_size)
+        return self.cached('%s_resized_%d' % (name, image_size), load)
+
+    @property
+    def target_train_data(self):
+        return self.load_dataset('target_train_data')
+
+    @property
+    def target_test_data(self):
+        return self.load_dataset('target_test_data')
+
+    @property
+    def not_target_train_data(self):
+        return self.load_dataset('not_target_train_data')
+
+    @property
+    def not_target_test_data(self):
+        return self.load_dataset('not_target_test_data')
+
+    @property
+    def vectorizer(self):
+        return self.load_pickle('vectorizer')
+
+    @property
+    def all_labels(self):
+        return self.load_pickle('all_labels')
+
+    @property
+    def not_target_labels(self):
+        """Names of the zero shot labels of the split. Folders written before the list was saved
+        get it from the labels the vectorizer was not fitted on"""
+        def load():
+            if os.path.isfile(os.path.join(self.pickle_folder, 'not_target_labels.pickle')):
+                return self.load_pickle('not_target_labels')
+            used_labels = set(self.vectorizer.classes_)
+            return sorted(L for L in self.all_labels if L not in used_labels)
+        return self.cached('not_target_labels_list', load)
+
+    @property
+    def glove(self):
+        return get_glove()
+
+    @property
+    def label_embeddings(self):
+        """Embedding table of all_labels. Built from the glove model if it was not saved yet"""
+        def load():
+            filename = os.path.join(self.pickle_folder, LABEL_EMBEDDINGS_FILE)
+            if os.path.isfile(filename):
+                return load_label_embeddings(filename)
+            label_embeddings = build_label_embeddings(self.all_labels)
+            save_label_embeddings(label_embeddings, filename)
+            return label_embeddings
+        return self.cached('label_embeddings', load)
+
+
+context = DataContext()
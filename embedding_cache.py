@@ -0,0 +1,113 @@
+# Cache of the projections (model.projection_layer outputs) of a dataset for a checkpoint.
+# The projections are computed once and saved as memory mapped .npy files, so the analysis
+# scripts (quantitative results, semantic groups, TSNE plots) do not run the CNN again.
+import hashlib
+import os
+import numpy as np
+import tensorflow as tf
+from models import Composite_model
+from data_context import context
+from columnar_dataset import concatenate_datasets
+
+num_classes = 60
+word2vec_size = 200
+
+IMAGE_SIZE = 24
+EVAL_BATCH_SIZE = 4096
+EMBEDDING_CACHE_FOLDER = 'embedding_cache'
+DONE_FILE = 'done'
+
+
+def build_projection_graph(image_size=IMAGE_SIZE):
+    """Creates the composite model graph for inference. Returns the input placeholder, the projection and a saver"""
+    x = tf.placeholder(tf.float32, [None, image_size, image_size, 3])
+    model = Composite_model(x, num_classes, word2vec_size, with_classifier=False)
+    saver = tf.train.Saver()
+    return x, model.projection_layer, saver
+
+
+def project_images(sess, x, model_output, images, batch_size=EVAL_BATCH_SIZE, outputs=None):
+    """Runs the projection over all the images (in order) and returns the (N, word2vec_size) outputs.
+    outputs can be an already allocated (e.g. memory mapped) array to write into"""
+    if outputs is None:
+        outputs = np.zeros((len(images), word2vec_size), dtype=np.float32)
+    for i in range(0, len(images), batch_size):
+        outputs[i:i + batch_size] = sess.run(model_output, {x: images[i:i + batch_size]})
+    return outputs
+
+
+def checkpoint_hash(check_point_file):
+    """Hash of a checkpoint. The .index file holds the checksum of every saved tensor, so hashing it is enough"""
+    index_file = check_point_file + '.index'
+    if not os.path.isfile(index_file):
+        index_file = check_point_file
+    with open(index_file, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()[:16]
+
+
+def dataset_signature(data):
+    """Short hash of the labels and image shape of a dataset, to detect a changed dataset with the same name"""
+    signature = hashlib.sha1(np.ascontiguousarray(data.fine_labels).tobytes())
+    signature.update(str(data.images.shape).encode())
+    return signature.hexdigest()[:8]
+
+
+def load_datasets(dataset_names, image_size=IMAGE_SIZE):
+    """Concatenates the resized datasets. Returns the dataset and the name identifying it in the cache"""
+    data = concatenate_datasets([context.resized_dataset(name, image_size) for name in dataset_names])
+    return data, '+'.join(dataset_names) + '_%d' % image_size
+
+
+class EmbeddingExtractor(object):
+    """Returns the cached projections of a dataset for a checkpoint. On a cache miss the
+    projections are extracted and saved; the graph and session are only built at the
+    first miss and reused for the next checkpoints"""
+    def __init__(self, image_size=IMAGE_SIZE, batch_size=EVAL_BATCH_SIZE, cache_folder=EMBEDDING_CACHE_FOLDER):
+        self.image_size = image_size
+        self.batch_size = batch_size
+        self.cache_folder = cache_folder
+        self.graph = None
+        self.sess = None
+
+    def cache_path(self, check_point_file, dataset_name, data):
+        """Folder of the cached projections of a dataset for a checkpoint"""
+        return os.path.join(self.cache_folder, '%s_%s_%s' % (checkpoint_hash(check_point_file), dataset_name,
+                                                              dataset_signature(data)))
+
+    def start_session(self):
+        """Builds the projection graph and opens its session"""
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.x, self.model_output, self.saver = build_projection_graph(self.image_size)
+        self.sess = tf.Session(graph=self.graph)
+
+    def extract(self, check_point_file, data, folder):
+        """Runs the checkpoint over the dataset and saves the projections and labels into folder"""
+        if self.sess is None:
+            self.start_session()
+        self.saver.restore(self.sess, check_point_file)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        outputs = np.lib.format.open_memmap(os.path.join(folder, 'embeddings.npy'), mode='w+', dtype=np.float32,
+                                            shape=(len(data), word2vec_size))
+        project_images(self.sess, self.x, self.model_output, data.images, self.batch_size, outputs)
+        outputs.flush()
+        del outputs
+        np.save(os.path.join(folder, 'labels.npy'), data.fine_names())
+        open(os.path.join(folder, DONE_FILE), 'w').close()
+
+    def embeddings(self, check_point_file, dataset_name, data):
+        """Returns the (memory mapped) projections of the dataset and the label name of every sample"""
+        folder = self.cache_path(check_point_file, dataset_name, data)
+        if not os.path.isfile(os.path.join(folder, DONE_FILE)):
+            print('EXTRACTING EMBEDDINGS', check_point_file, dataset_name)
+            self.extract(check_point_file, data, folder)
+        outputs = np.load(os.path.join(folder, 'embeddings.npy'), mmap_mode='r')
+        labels = np.load(os.path.join(folder, 'labels.npy')).tolist()
+        return outputs, labels
+
+    def close(self):
+        if self.sess is not None:
+            self.sess.close()
+            self.sess = None
@@ -0,0 +1,117 @@
+# High throughput version of computer_quantitative_results.get_results.
+# The projections are computed with large batches and all the metrics are computed
+# with array operations over the whole (images x labels) distance matrix.
+import argparse
+import csv
+import multiprocessing
+import pickle
+import time
+import numpy as np
+import tensorflow as tf
+from data_context import context
+from quantitative_utils import *
+from embedding_cache import build_projection_graph, project_images, IMAGE_SIZE, EVAL_BATCH_SIZE
+
+TABLE_COLUMNS = ['top_k_accuracy', 'zero_shot_top_k_accuracy', 'mean_distance', 'superclass_accuracy',
+                 'images_per_second']
+
+
+def evaluate_checkpoint(sess, saver, x, model_output, check_point_file, data, batch_size=EVAL_BATCH_SIZE, k=TOP_K):
+    """Restores a checkpoint and computes its quantitative results over a columnar dataset"""
+    saver.restore(sess, check_point_file)
+
+    start = time.time()
+    outputs = project_images(sess, x, model_output, data.images, batch_size)
+    projection_time = time.time() - start
+
+    results = score_projections(outputs, data.fine_names().tolist(), k)
+    total_time = time.time() - start
+
+    results['images_per_second'] = len(data) / projection_time
+    results['total_images_per_second'] = len(data) / total_time
+    return results
+
+
+def load_evaluation_data():
+    """Memory maps the (already resized) zero shot images"""
+    return (context.resized_dataset('not_target_train_data', IMAGE_SIZE) +
+            context.resized_dataset('not_target_test_data', IMAGE_SIZE))
+
+
+def evaluate_sweep(check_point_files, data, batch_size=EVAL_BATCH_SIZE, k=TOP_K):
+    """Evaluates several checkpoints building the graph once and restoring each checkpoint in the same session"""
+    results = {}
+    graph = tf.Graph()
+    with graph.as_default():
+        x, model_output, saver = build_projection_graph()
+        with tf.Session(graph=graph) as sess:
+            for check_point_file in check_point_files:
+                results[check_point_file] = evaluate_checkpoint(sess, saver, x, model_output, check_point_file,
+                                                                data, batch_size, k)
+                print_summary(check_point_file, results[check_point_file], k)
+    return results
+
+
+def sweep_worker(worker_args):
+    """Evaluates a share of the checkpoints in a worker process"""
+    check_point_files, batch_size, k = worker_args
+    return evaluate_sweep(check_point_files, load_evaluation_data(), batch_size, k)
+
+
+def evaluate_sweep_parallel(check_point_files, num_workers, batch_size=EVAL_BATCH_SIZE, k=TOP_K):
+    """Splits the checkpoints between worker processes, each one with its own graph and session"""
+    # The resized caches are built here, the workers only memory map them
+    load_evaluation_data()
+    shares = [check_point_files[i::num_workers] for i in range(num_workers) if check_point_files[i::num_workers]]
+    pool = multiprocessing.get_context('spawn').Pool(len(shares))
+    try:
+        worker_results = pool.map(sweep_worker, [(share, batch_size, k) for share in shares])
+    finally:
+        pool.close()
+        pool.join()
+
+    results = {}
+    for r in worker_results:
+        results.update(r)
+    return results
+
+
+def write_results_table(results, check_point_files, filename):
+    """Writes the overall metrics of every checkpoint into a csv file"""
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['checkpoint'] + TABLE_COLUMNS)
+        for check_point_file in check_point_files:
+            writer.writerow([check_point_file] + [results[check_point_file][c] for c in TABLE_COLUMNS])
+
+
+def print_summary(name, results, k=TOP_K):
+    """Prints the overall metrics of a result dict"""
+    print('%s: top-%d %.4f | zero shot top-%d %.4f | mean distance %.4f | superclass %.4f | %.0f images/s' %
+          (name, k, results['top_k_accuracy'], k, results['zero_shot_top_k_accuracy'], results['mean_distance'],
+           results['superclass_accuracy'], results['total_images_per_second']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Computes the quantitative results of a composite model checkpoint '
+                                                 'over the zero shot images')
+    parser.add_argument('checkpoints', nargs='+')
+    parser.add_argument('--output', help='Pickle file where the results of all checkpoints are saved')
+    parser.add_argument('--table', help='Csv file with the overall metrics of every checkpoint')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes evaluating checkpoints')
+    parser.add_argument('--batch-size', type=int, default=EVAL_BATCH_SIZE)
+    parser.add_argument('--top-k', type=int, default=TOP_K)
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        results = evaluate_sweep_parallel(args.checkpoints, args.workers, args.batch_size, args.top_k)
+    else:
+        results = evaluate_sweep(args.checkpoints, load_evaluation_data(), args.batch_size, args.top_k)
+
+    if args.table:
+        write_results_table(results, args.checkpoints, args.table)
+
+    if args.output:
+        out = open(args.output, 'wb')
+        pickle.dump(results, out)
+        out.close()
@@ -0,0 +1,122 @@
+# Freezes a composite model checkpoint into a minimal inference graph.
+# The graph only holds the ops from the 'input' placeholder to the 'projection' output: the
+# classification head is not built, the optimizer slots are not restored and the variables
+# are stored as constants. Optionally the weights are stored as float16 (cast back to float32 on load).
+import argparse
+import os
+import numpy as np
+import tensorflow as tf
+from models import Composite_model
+
+num_classes = 60
+word2vec_size = 200
+
+IMAGE_SIZE = 24
+INPUT_NAME = 'input'
+OUTPUT_NAME = 'projection'
+HALF_SUFFIX = '/half'
+
+
+def build_inference_graph(image_size=IMAGE_SIZE, use_vgg=False):
+    """Builds the composite model without its classification head. Returns the input and projection tensors"""
+    x = tf.placeholder(tf.float32, [None, image_size, image_size, 3], name=INPUT_NAME)
+    model = Composite_model(x, num_classes, word2vec_size, use_vgg=use_vgg, with_classifier=False)
+    return x, tf.identity(model.projection_layer, name=OUTPUT_NAME)
+
+
+def weights_to_float16(graph_def):
+    """Stores the float32 constants as float16 followed by a cast to float32, halving the weights size"""
+    converted = tf.GraphDef()
+    for node in graph_def.node:
+        if node.op == 'Const' and node.attr['dtype'].type == tf.float32.as_datatype_enum:
+            values = tf.make_ndarray(node.attr['value'].tensor)
+            # Scalars (e.g. the LRN and standardization constants) are kept in float32
+            if values.size > 1:
+                half = converted.node.add()
+                half.op = 'Const'
+                half.name = node.name + HALF_SUFFIX
+                half.device = node.device
+                half.attr['dtype'].type = tf.float16.as_datatype_enum
+                half.attr['value'].tensor.CopyFrom(tf.make_tensor_proto(values.astype(np.float16)))
+
+                cast = converted.node.add()
+                cast.op = 'Cast'
+                cast.name = node.name
+                cast.device = node.device
+                cast.input.append(half.name)
+                cast.attr['SrcT'].type = tf.float16.as_datatype_enum
+                cast.attr['DstT'].type = tf.float32.as_datatype_enum
+                continue
+        converted.node.add().CopyFrom(node)
+    converted.library.CopyFrom(graph_def.library)
+    converted.versions.CopyFrom(graph_def.versions)
+    return converted
+
+
+def export_inference_graph(check_point_file, output_file, image_size=IMAGE_SIZE, use_vgg=False, float16=False):
+    """Restores the model variables from a checkpoint and writes the frozen inference graph.
+    Returns the frozen GraphDef"""
+    graph = tf.Graph()
+    with graph.as_default():
+        build_inference_graph(image_size, use_vgg)
+        # Only the variables of the inference graph are restored, the optimizer slots are ignored
+        saver = tf.train.Saver(tf.global_variables())
+        with tf.Session(graph=graph) as sess:
+            saver.restore(sess, check_point_file)
+            graph_def = tf.graph_util.convert_variables_to_constants(sess, graph.as_graph_def(), [OUTPUT_NAME])
+    graph_def = tf.graph_util.remove_training_nodes(graph_def, protected_nodes=[INPUT_NAME, OUTPUT_NAME])
+    if float16:
+        graph_def = weights_to_float16(graph_def)
+
+    with tf.gfile.GFile(output_file, 'wb') as f:
+        f.write(graph_def.SerializeToString())
+    return graph_def
+
+
+def load_inference_graph(graph_file):
+    """Loads a frozen inference graph into a new tf.Graph. Returns the graph, input and projection tensors"""
+    graph_def = tf.GraphDef()
+    with tf.gfile.GFile(graph_file, 'rb') as f:
+        graph_def.ParseFromString(f.read())
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.import_graph_def(graph_def, name='')
+    return graph, graph.get_tensor_by_name(INPUT_NAME + ':0'), graph.get_tensor_by_name(OUTPUT_NAME + ':0')
+
+
+class InferenceModel(object):
+    """Session over a frozen inference graph that projects batches of images"""
+    def __init__(self, graph_file):
+        self.graph, self.x, self.projection = load_inference_graph(graph_file)
+        self.sess = tf.Session(graph=self.graph)
+
+    def project(self, images, batch_size=4096):
+        """Returns the (N, word2vec_size) projections of the images"""
+        outputs = np.zeros((len(images), word2vec_size), dtype=np.float32)
+        for i in range(0, len(images), batch_size):
+            outputs[i:i + batch_size] = self.sess.run(self.projection, {self.x: images[i:i + batch_size]})
+        return outputs
+
+    def close(self):
+        self.sess.close()
+
+
+def checkpoint_size(check_point_file):
+    """Size in bytes of all the files of a checkpoint"""
+    folder = os.path.dirname(check_point_file) or '.'
+    prefix = os.path.basename(check_point_file) + '.'
+    return sum(os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder) if f.startswith(prefix))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Freezes a composite model checkpoint into an inference graph')
+    parser.add_argument('checkpoint')
+    parser.add_argument('output', help='.pb file for the frozen graph')
+    parser.add_argument('--image-size', type=int, default=IMAGE_SIZE)
+    parser.add_argument('--vgg', action='store_true', help='The checkpoint is of a composite model using VGG19')
+    parser.add_argument('--float16', action='store_true', help='Store the weights as float16')
+    args = parser.parse_args()
+
+    graph_def = export_inference_graph(args.checkpoint, args.output, args.image_size, args.vgg, args.float16)
+    print('%d nodes, %.2f MB (checkpoint %.2f MB)' % (len(graph_def.node), os.path.getsize(args.output) / 2.0 ** 20,
+                                                      checkpoint_size(args.checkpoint) / 2.0 ** 20))
@@ -1,19 +1,17 @@
 # Partialy based on https://kratzert.github.io/2017/02/24/finetuning-alexnet-with-tensorflow.html
 
-import tensorflow as tf
 import numpy as np
 import pickle
 import os
 import matplotlib.pyplot as plt
 from datetime import datetime
-from models import Composite_model
 from batch_making import *
+from data_context import context
 from sklearn.manifold import TSNE
 from quantitative_utils import *
+from embedding_cache import EmbeddingExtractor, load_datasets
 
-batch_size = 128
-num_classes = 60
-word2vec_size = 200
+batch_size = 1024  # Only used for inference, the graph accepts any batch size
 
 IMAGE_SIZE = 24
 CHECK_POINT_FILES = []  # Change here
@@ -25,48 +23,48 @@ if len(CHECK_POINT_FILES) == 0 or len(OUTPUT_FILES) == 0 or OUTPUT_FILES_FOLDER
 
 AUTO_COMPUTE = True
 
-x = tf.placeholder(tf.float32, [batch_size, IMAGE_SIZE, IMAGE_SIZE, 3])
-y = tf.placeholder(tf.float32, [None, word2vec_size])
+all_not_target, all_not_target_name = load_datasets(['not_target_train_data', 'not_target_test_data'], IMAGE_SIZE)
 
-model = Composite_model(x, num_classes, word2vec_size)
-model_output = model.projection_layer
 
-saver = tf.train.Saver()
-all_not_target = not_target_train_data + not_target_test_data
+def add_cooccurrences(corr_m, correct_rows, closest_rows):
+    """Adds to the matrix one co-occurrence (in both directions) between the correct class
+    of each sample and each one of its closest classes"""
+    num_labels = len(corr_m)
+    correct_rows = np.repeat(correct_rows, closest_rows.shape[1])
+    closest_rows = closest_rows.ravel()
+    counts = np.bincount(correct_rows * num_labels + closest_rows, minlength=num_labels * num_labels)
+    counts = counts.reshape(num_labels, num_labels)
+    corr_m += counts + counts.T
 
 
-def get_results(check_point_file):
-    """Create a correlation like matrix between classes from a model checkpoint file"""
-    data_generator = get_batches(all_not_target, batch_size, IMAGE_SIZE, word2vec=True, send_raw_str=True)
+def get_results(check_point_file, extractor=None):
+    """Create a correlation like matrix between classes from a model checkpoint file.
+    The projections are read from the embedding cache; an extractor can be given to reuse
+    its graph and session between checkpoints"""
+    if extractor is None:
+        extractor = EmbeddingExtractor(IMAGE_SIZE, batch_size)
+        try:
+            return get_results(check_point_file, extractor)
+        finally:
+            extractor.close()
+
+    outputs, output_labels = extractor.embeddings(check_point_file, all_not_target_name, all_not_target)
     all_labels = []
     for k in classes.keys():
         all_labels += [normalize_label(L) for L in classes[k]]
+    label_index = {}
+    for i, L in enumerate(all_labels):
+        label_index.setdefault(L, i)
     corr_m = np.zeros((len(all_labels), len(all_labels)))
 
-    points = {}
-    for label in all_labels:
-        points[normalize_label(label)] = []
-
-    # Start Tensorflow session
-    with tf.Session() as sess:
-
-        # Initialize all variables
-        sess.run(tf.global_variables_initializer())
-
-        # Load the pretrained weights into the non-trainable layer
-        saver.restore(sess, check_point_file)
+    ranker = get_label_ranker()
+    ranker_to_matrix = np.array([label_index[normalize_label(L)] for L in ranker.labels])
+    correct_rows = np.array([label_index[normalize_label(L)] for L in output_labels])
 
-        for batch_x, batch_y, batch_labels in data_generator:
-            output = sess.run(model_output, {x: batch_x})
-            for i, o in enumerate(output):
-                closest_words = get_closest_words_cosine(o)[:5]
-                correct_label = batch_labels[i]
-                i1 = all_labels.index(normalize_label(correct_label))
-                for cw in closest_words:
-                    i2 = all_labels.index(normalize_label(cw))
-                    corr_m[i1][i2] += 1
-                    corr_m[i2][i1] += 1
-        return {'matrix': corr_m, 'labels': all_labels}
+    for start in range(0, len(outputs), batch_size):
+        closest_rows = ranker_to_matrix[ranker.top_k(outputs[start:start + batch_size], 5, metric='cosine')]
+        add_cooccurrences(corr_m, correct_rows[start:start + batch_size], closest_rows)
+    return {'matrix': corr_m, 'labels': all_labels}
 
 
 def show_results(result):
@@ -83,13 +81,15 @@ def show_results(result):
 
 
 if AUTO_COMPUTE:
-    "Create the correlation matrix from all the checkpoint files"
+    "Create the correlation matrix from all the checkpoint files, reusing the same graph and session"
+    extractor = EmbeddingExtractor(IMAGE_SIZE, batch_size)
     for i, check_point_file in enumerate(CHECK_POINT_FILES):
         output_file = OUTPUT_FILES[i]
         print('COMPUTING', check_point_file)
-        results = get_results(check_point_file)
+        results = get_results(check_point_file, extractor)
         out = open(os.path.join(OUTPUT_FILES_FOLDER, output_file + '.pickle'), 'wb')
         pickle.dump(results, out)
         out.close()
+    extractor.close()
 
 print('DONE')
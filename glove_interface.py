@@ -1,12 +1,9 @@
-import pandas as pd
-import csv
 import numpy as np
+import os
 
 glove_data_file = 'glove.6B/glove.6B.200d.txt'
-
-print('Loading glove model')
-words = pd.read_table(glove_data_file, sep=" ", index_col=0, header=None, quoting=csv.QUOTE_NONE)
-print('Loaded')
+glove_vectors_file = 'glove.6B/glove.6B.200d.npy'
+glove_vocab_file = 'glove.6B/glove.6B.200d.vocab'
 
 norm_mean = 5.5293
 
@@ -25,6 +22,77 @@ composite_words = {
 }
 
 
+def convert_glove_to_binary(text_file=glove_data_file, vectors_file=glove_vectors_file,
+                            vocab_file=glove_vocab_file):
+    """Converts the glove text file into a float32 .npy matrix plus a vocabulary file (one word per line).
+    Both are written to temporary files renamed once complete, so an interrupted conversion is redone"""
+    with open(text_file, 'r', encoding='utf8') as f:
+        num_words = 0
+        for line in f:
+            num_words += 1
+    with open(text_file, 'r', encoding='utf8') as f:
+        num_dims = len(f.readline().rstrip('\n').split(' ')) - 1
+
+    tmp_vectors_file = '%s.%d.tmp' % (vectors_file, os.getpid())
+    tmp_vocab_file = '%s.%d.tmp' % (vocab_file, os.getpid())
+    try:
+        vectors = np.lib.format.open_memmap(tmp_vectors_file, mode='w+', dtype=np.float32,
+                                            shape=(num_words, num_dims))
+        with open(text_file, 'r', encoding='utf8') as f, open(tmp_vocab_file, 'w', encoding='utf8') as vocab:
+            for i, line in enumerate(f):
+                values = line.rstrip('\n').split(' ')
+                vocab.write(values[0] + '\n')
+                vectors[i] = np.array(values[1:], dtype=np.float32)
+        vectors.flush()
+        del vectors
+        # The vectors are renamed last, load_glove converts again while they are missing
+        os.replace(tmp_vocab_file, vocab_file)
+        os.replace(tmp_vectors_file, vectors_file)
+    finally:
+        for filename in [tmp_vectors_file, tmp_vocab_file]:
+            if os.path.isfile(filename):
+                os.remove(filename)
+
+
+def read_vocab(vocab_file=glove_vocab_file):
+    """Returns the words of the vocabulary file, one per row of the vector matrix"""
+    with open(vocab_file, 'r', encoding='utf8') as vocab:
+        return [line.rstrip('\n') for line in vocab]
+
+
+def load_glove(vectors_file=glove_vectors_file, vocab_file=glove_vocab_file):
+    """Memory maps the binary glove model. Returns the vector matrix and a word -> row dict.
+    The model is converted again when a file is missing or the files do not match"""
+    words = None
+    vectors = None
+    if os.path.isfile(vectors_file) and os.path.isfile(vocab_file):
+        vectors = np.load(vectors_file, mmap_mode='r')
+        words = read_vocab(vocab_file)
+    if vectors is None or len(vectors) != len(words):
+        print('Converting glove model to binary (only done once)')
+        convert_glove_to_binary(vectors_file=vectors_file, vocab_file=vocab_file)
+        vectors = np.load(vectors_file, mmap_mode='r')
+        words = read_vocab(vocab_file)
+
+    word_index = {}
+    for i, word in enumerate(words):
+        word_index.setdefault(word, i)
+    return vectors, word_index
+
+
+_glove = None
+
+
+def get_glove():
+    """Returns the (vectors, word_index) glove model, loading it on the first call"""
+    global _glove
+    if _glove is None:
+        print('Loading glove model')
+        _glove = load_glove()
+        print('Loaded')
+    return _glove
+
+
 def normalize_label(label):
     """Turn composite words to single words"""
     if label in composite_words:
@@ -33,23 +101,18 @@ def normalize_label(label):
         return label
 
 
-def find_norm_mean():
+def find_norm_mean(chunk_size=10000):
     """Find the mean norm of the word2vec representations"""
-    all_words = words.index.values
-    count = .0
+    word_vectors, word_index = get_glove()
     norm_sum = .0
-
-    for w in all_words:
-        new_norm = np.linalg.norm(words.loc[w].as_matrix())
-        norm_sum += new_norm
-        count += 1
-    norm_sum /= count
-    return norm_sum
+    for i in range(0, len(word_vectors), chunk_size):
+        norm_sum += np.sum(np.linalg.norm(word_vectors[i:i + chunk_size], axis=1))
+    return norm_sum / len(word_vectors)
 
 
 def find_word_vec(word):
     """Gets the word2vec representation from a word"""
-    try:
-        return words.loc[word].as_matrix() / norm_mean
-    except:
+    word_vectors, word_index = get_glove()
+    if word not in word_index:
         return None
+    return word_vectors[word_index[word]] / norm_mean
@@ -1,6 +1,5 @@
 import numpy as np
-import matplotlib.pyplot as plt
-import scipy.misc
+from functools import lru_cache
 
 NUM_CHANNELS = 3
 
@@ -13,6 +12,13 @@ def image_array_to_image_matrix(image_array):
     return image_matrix
 
 
+def image_arrays_to_image_matrices(image_arrays):
+    """Converts a batch of CIFAR-100 (CHW flat) images into a (batch, height, width, channels) array"""
+    image_size = int(np.sqrt(np.shape(image_arrays)[1] / NUM_CHANNELS))
+
+    return image_arrays.reshape(-1, NUM_CHANNELS, image_size, image_size).transpose(0, 2, 3, 1)
+
+
 def image_matrix_to_image_array(image_matrix):
     """Gets a image matrix for use in CNNs and converts it back to a CIFAR-100 like matrix"""
     image_size = np.shape(image_matrix)[1]
@@ -23,6 +29,8 @@ def image_matrix_to_image_array(image_matrix):
 
 def visualize_image(image):
     """Displays the image in a CIFAR-100 matrix"""
+    import matplotlib.pyplot as plt
+
     num_dims = len(np.shape(image))
     if num_dims == 1:
         image_to_visualize = image_array_to_image_matrix(image)
@@ -36,7 +44,31 @@ def visualize_image(image):
     plt.show()
 
 
+@lru_cache(maxsize=None)
+def bilinear_resize_weights(in_size, out_size):
+    """Creates the (out_size, in_size) interpolation matrix of a bilinear resize along one axis.
+    As in PIL (used by the old scipy.misc.imresize), the filter is widened when downscaling"""
+    scale = in_size / float(out_size)
+    support = max(scale, 1.0)
+    weights = np.zeros((out_size, in_size), dtype=np.float32)
+    for i in range(out_size):
+        center = (i + 0.5) * scale
+        x_min = max(int(center - support + 0.5), 0)
+        x_max = min(int(center + support + 0.5), in_size)
+        w = np.maximum(1 - np.abs((np.arange(x_min, x_max) - center + 0.5) / support), 0)
+        weights[i, x_min:x_max] = w / np.sum(w)
+    return weights
+
+
+def resize_image_batch(image_batch, new_x_size, new_y_size):
+    """Resize a (batch, height, width, channels) uint8 image batch with two matrix products"""
+    weights_x = bilinear_resize_weights(np.shape(image_batch)[1], new_x_size)
+    weights_y = bilinear_resize_weights(np.shape(image_batch)[2], new_y_size)
+    resized = np.einsum('xh,nhwc->nxwc', weights_x, np.asarray(image_batch, dtype=np.float32))
+    resized = np.einsum('yw,nxwc->nxyc', weights_y, resized)
+    return np.clip(np.rint(resized), 0, 255).astype(np.uint8)
+
+
 def resize_image_matrix(image_matrix, new_x_size, new_y_size):
     """Resize a image matrix"""
-    new_image = scipy.misc.imresize(image_matrix, (new_x_size, new_y_size))
-    return new_image
+    return resize_image_batch(image_matrix[np.newaxis], new_x_size, new_y_size)[0]
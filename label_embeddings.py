@@ -0,0 +1,47 @@
+import numpy as np
+from glove_interface import find_word_vec, normalize_label
+
+LABEL_EMBEDDINGS_FILE = 'label_embeddings.npz'
+
+
+class LabelEmbeddings(object):
+    """Word2vec representations of the dataset labels (one row per label), indexed by normalized label"""
+    def __init__(self, labels, matrix):
+        self.labels = list(labels)
+        self.matrix = np.asarray(matrix, dtype=np.float32)
+        self.index = {}
+        for i, label in enumerate(self.labels):
+            self.index.setdefault(normalize_label(label), i)
+
+    def row(self, label):
+        """Returns the row of a (raw or normalized) label"""
+        return self.index[normalize_label(label)]
+
+    def rows(self, labels):
+        """Returns the rows of a list of labels"""
+        return np.array([self.row(L) for L in labels], dtype=np.int64)
+
+    def vector(self, label):
+        """Returns the word2vec representation of a label"""
+        return self.matrix[self.row(label)]
+
+    def vectors(self, labels):
+        """Returns the (len(labels), word2vec_size) matrix with the representations of the labels"""
+        return self.matrix[self.rows(labels)]
+
+
+def build_label_embeddings(labels):
+    """Looks up the labels in the glove model to create their embedding table"""
+    matrix = [find_word_vec(normalize_label(L)) for L in labels]
+    return LabelEmbeddings(labels, np.array(matrix, dtype=np.float32))
+
+
+def save_label_embeddings(label_embeddings, filename):
+    """Saves the embedding table to a .npz file"""
+    np.savez(filename, labels=np.array(label_embeddings.labels), matrix=label_embeddings.matrix)
+
+
+def load_label_embeddings(filename):
+    """Loads an embedding table saved by save_label_embeddings"""
+    with np.load(filename) as f:
+        return LabelEmbeddings(f['labels'].tolist(), f['matrix'])
@@ -0,0 +1,266 @@
+# Nearest neighbour indexes to rank projections against a large vocabulary (e.g. the glove words).
+# ExactLabelIndex computes the distances block by block over the vocabulary, keeping the running top-k.
+# IVFLabelIndex (inverted file) clusters the vocabulary with k-means and only searches the nprobe
+# clusters closest to each query, trading some recall for a much lower latency.
+import argparse
+import time
+import numpy as np
+from glove_interface import get_glove, norm_mean
+
+SEARCH_BLOCK_SIZE = 8192
+IVF_NUM_LISTS = 256
+IVF_NPROBE = 8
+KMEANS_ITERATIONS = 10
+KMEANS_TRAIN_SIZE = 65536
+
+
+def top_k_indices(distances, k):
+    """Returns, for every row of a distance matrix, the columns of the k smallest distances in a crescent order"""
+    k = min(k, distances.shape[1])
+    if k < distances.shape[1]:
+        candidates = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.tile(np.arange(k), (len(distances), 1))
+    candidate_distances = np.take_along_axis(distances, candidates, axis=1)
+    order = np.argsort(candidate_distances, axis=1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def prepare_vectors(vectors, metric):
+    """Float32 2D copy of the vectors, scaled to unit norm for the cosine metric"""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    if metric == 'cosine':
+        norms = np.linalg.norm(vectors, axis=1)[:, np.newaxis]
+        return vectors / np.maximum(norms, 1e-12)
+    elif metric == 'euclidean':
+        return np.array(vectors)
+    raise ValueError("metric should be 'cosine' or 'euclidean'")
+
+
+def block_distances(queries, block, block_sq_norms, metric):
+    """(queries, block) distance matrix. The queries and block are already prepared for the metric"""
+    if metric == 'cosine':
+        return 1 - np.dot(queries, block.T)
+    sq_distances = np.sum(queries ** 2, axis=1)[:, np.newaxis] - 2 * np.dot(queries, block.T) + block_sq_norms
+    return np.sqrt(np.maximum(sq_distances, 0))
+
+
+class ExactLabelIndex(object):
+    """Brute force search. The vocabulary is scanned in blocks so the distance matrix
+    of a batch never exceeds (batch, block_size)"""
+    def __init__(self, words, matrix, metric='cosine', block_size=SEARCH_BLOCK_SIZE):
+        self.words = np.array(words)
+        self.metric = metric
+        self.block_size = block_size
+        self.matrix = prepare_vectors(matrix, metric)
+        self.sq_norms = np.sum(self.matrix ** 2, axis=1)
+
+    def __len__(self):
+        return len(self.words)
+
+    def search(self, vectors, k=5):
+        """Returns the (batch, k) indices and distances of the closest words in a crescent distance order"""
+        queries = prepare_vectors(vectors, self.metric)
+        best_indices = np.zeros((len(queries), 0), dtype=np.int64)
+        best_distances = np.zeros((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(self.matrix), self.block_size):
+            end = start + self.block_size
+            distances = block_distances(queries, self.matrix[start:end], self.sq_norms[start:end], self.metric)
+            indices = np.broadcast_to(np.arange(start, start + distances.shape[1]), distances.shape)
+
+            distances = np.concatenate([best_distances, distances], axis=1)
+            indices = np.concatenate([best_indices, indices], axis=1)
+            top = top_k_indices(distances, k)
+            best_distances = np.take_along_axis(distances, top, axis=1)
+            best_indices = np.take_along_axis(indices, top, axis=1)
+        return best_indices, best_distances
+
+    def closest_words(self, vectors, k=5):
+        """Returns the (batch, k) closest words in a crescent distance order"""
+        return self.words[self.search(vectors, k)[0]]
+
+
+def kmeans(vectors, num_clusters, metric, iterations=KMEANS_ITERATIONS, rng=None):
+    """Lloyd's k-means. For the cosine metric the vectors are unit norm and the centroids are
+    renormalized after every update (spherical k-means). Returns the centroids"""
+    rng = rng or np.random.RandomState(0)
+    centroids = vectors[rng.choice(len(vectors), num_clusters, replace=False)]
+    for i in range(iterations):
+        sq_norms = np.sum(centroids ** 2, axis=1)
+        assignment = np.argmin(block_distances(vectors, centroids, sq_norms, metric), axis=1)
+        counts = np.bincount(assignment, minlength=num_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        # Empty clusters keep their previous centroid
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled][:, np.newaxis]
+        if metric == 'cosine':
+            centroids = prepare_vectors(centroids, metric)
+    return centroids
+
+
+class IVFLabelIndex(object):
+    """Inverted file index. The vocabulary is sorted by k-means cluster, so every cluster
+    (inverted list) is a contiguous slice of the matrix and a query only computes the
+    distances to the words of its nprobe closest clusters"""
+    def __init__(self, words, matrix, metric='cosine', num_lists=IVF_NUM_LISTS, nprobe=IVF_NPROBE,
+                 iterations=KMEANS_ITERATIONS, train_size=KMEANS_TRAIN_SIZE, seed=0):
+        self.metric = metric
+        self.nprobe = nprobe
+        matrix = prepare_vectors(matrix, metric)
+        num_lists = min(num_lists, len(matrix))
+
+        rng = np.random.RandomState(seed)
+        train = matrix if len(matrix) <= train_size else matrix[rng.choice(len(matrix), train_size, replace=False)]
+        self.centroids = kmeans(train, num_lists, metric, iterations, rng)
+        self.centroid_sq_norms = np.sum(self.centroids ** 2, axis=1)
+
+        assignment = np.concatenate([
+            np.argmin(block_distances(matrix[i:i + SEARCH_BLOCK_SIZE], self.centroids, self.centroid_sq_norms,
+                                      metric), axis=1)
+            for i in range(0, len(matrix), SEARCH_BLOCK_SIZE)])
+        order = np.argsort(assignment, kind='stable')
+        self.word_rows = order
+        self.words = np.array(words)
+        self.matrix = matrix[order]
+        self.sq_norms = np.sum(self.matrix ** 2, axis=1)
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=num_lists))])
+
+    def __len__(self):
+        return len(self.words)
+
+    def search(self, vectors, k=5):
+        """Returns the (batch, k) indices and distances of the (approximately) closest words.
+        The batch is grouped by probed cluster, so every cluster is scanned once with a single matrix
+        product for all its queries. A query probes more than nprobe clusters when its nprobe closest
+        clusters hold less than k words, so every result is a real word"""
+        queries = prepare_vectors(vectors, self.metric)
+        k = min(k, len(self.words))
+        ranked = np.argsort(block_distances(queries, self.centroids, self.centroid_sq_norms, self.metric), axis=1)
+        covered = np.cumsum(np.diff(self.offsets)[ranked], axis=1)
+        num_probes = np.minimum(np.maximum(np.argmax(covered >= k, axis=1) + 1, self.nprobe), ranked.shape[1])
+        probes = ranked[:, :num_probes.max()]
+        probed = np.arange(probes.shape[1]) < num_probes[:, np.newaxis]
+
+        # Top-k of every (query, probed cluster) pair
+        candidate_indices = np.zeros(probes.shape + (k,), dtype=np.int64)
+        candidate_distances = np.full(probes.shape + (k,), np.inf, dtype=np.float32)
+        pair_queries, pair_probes = np.nonzero(probed)
+        pair_lists = probes[probed]
+        order = np.argsort(pair_lists, kind='stable')
+        boundaries = np.flatnonzero(np.diff(pair_lists[order])) + 1
+        for pairs in np.split(order, boundaries):
+            p = pair_lists[pairs[0]]
+            start, end = self.offsets[p], self.offsets[p + 1]
+            if start == end:
+                continue
+            distances = block_distances(queries[pair_queries[pairs]], self.matrix[start:end],
+                                        self.sq_norms[start:end], self.metric)
+            top = top_k_indices(distances, k)
+            candidate_indices[pair_queries[pairs], pair_probes[pairs], :top.shape[1]] = start + top
+            candidate_distances[pair_queries[pairs], pair_probes[pairs], :top.shape[1]] = \
+                np.take_along_axis(distances, top, axis=1)
+
+        candidate_indices = candidate_indices.reshape(len(queries), -1)
+        candidate_distances = candidate_distances.reshape(len(queries), -1)
+        top = top_k_indices(candidate_distances, k)
+        best_indices = np.take_along_axis(candidate_indices, top, axis=1)
+        best_distances = np.take_along_axis(candidate_distances, top, axis=1)
+        return self.word_rows[best_indices], best_distances
+
+    def closest_words(self, vectors, k=5):
+        """Returns the (batch, k) closest words in a crescent distance order"""
+        return self.words[self.search(vectors, k)[0]]
+
+
+LABEL_INDEX_BACKENDS = {
+    'exact': ExactLabelIndex,
+    'ivf': IVFLabelIndex,
+}
+
+
+def build_label_index(words, matrix, backend='exact', **options):
+    """Builds an index over the rows of matrix with one of the registered backends"""
+    if backend not in LABEL_INDEX_BACKENDS:
+        raise ValueError('Unknown label index backend %s, choose one of %s' %
+                         (backend, ', '.join(sorted(LABEL_INDEX_BACKENDS.keys()))))
+    return LABEL_INDEX_BACKENDS[backend](words, matrix, **options)
+
+
+def glove_vocabulary(vocabulary_size, extra_words=()):
+    """Returns the vocabulary_size most frequent glove words (plus the extra words found in the model)
+    and their (scaled by norm_mean) vectors"""
+    word_vectors, word_index = get_glove()
+    rows = sorted(set(r for r in word_index.values() if r < vocabulary_size) |
+                  set(word_index[w] for w in extra_words if w in word_index))
+    words = [None] * len(rows)
+    row_position = dict((r, i) for i, r in enumerate(rows))
+    for w, r in word_index.items():
+        if r in row_position:
+            words[row_position[r]] = w
+    return words, np.asarray(word_vectors[rows], dtype=np.float32) / norm_mean
+
+
+def vocabulary_index(vocabulary_size, backend='exact', extra_words=(), **options):
+    """Builds an index over the glove vocabulary"""
+    words, matrix = glove_vocabulary(vocabulary_size, extra_words)
+    return build_label_index(words, matrix, backend, **options)
+
+
+def measure_index(index, exact_index, queries, k=5, batch_size=256):
+    """Recall@k of an index against the exact search and its mean latency per query (batched and single)"""
+    exact, _ = exact_index.search(queries, k)
+
+    start = time.time()
+    found = np.concatenate([index.search(queries[i:i + batch_size], k)[0]
+                            for i in range(0, len(queries), batch_size)])
+    batch_latency = (time.time() - start) / len(queries)
+
+    num_single = min(len(queries), 100)
+    start = time.time()
+    for query in queries[:num_single]:
+        index.search(query, k)
+    single_latency = (time.time() - start) / num_single
+
+    hits = [len(np.intersect1d(f, e)) for f, e in zip(found, exact)]
+    return {'recall': np.sum(hits) / float(exact.size), 'batch_latency': batch_latency,
+            'single_latency': single_latency}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Recall and latency of the label index backends over the glove '
+                                                 'vocabulary')
+    parser.add_argument('--vocabulary-size', type=int, default=100000)
+    parser.add_argument('--backends', nargs='+', default=sorted(LABEL_INDEX_BACKENDS.keys()),
+                        choices=sorted(LABEL_INDEX_BACKENDS.keys()))
+    parser.add_argument('--metric', default='cosine', choices=['cosine', 'euclidean'])
+    parser.add_argument('--num-lists', type=int, default=IVF_NUM_LISTS)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[IVF_NPROBE])
+    parser.add_argument('--queries', help='.npy file with projections to use as queries '
+                                          '(e.g. an embedding_cache embeddings.npy); by default noisy word vectors')
+    parser.add_argument('--num-queries', type=int, default=1000)
+    parser.add_argument('--top-k', type=int, default=5)
+    args = parser.parse_args()
+
+    words, matrix = glove_vocabulary(args.vocabulary_size)
+    rng = np.random.RandomState(0)
+    if args.queries:
+        queries = np.load(args.queries, mmap_mode='r')
+        queries = np.asarray(queries[rng.choice(len(queries), min(args.num_queries, len(queries)), replace=False)])
+    else:
+        queries = matrix[rng.choice(len(matrix), args.num_queries)]
+        queries = queries + rng.normal(scale=np.std(matrix), size=queries.shape).astype(np.float32)
+
+    exact_index = ExactLabelIndex(words, matrix, args.metric)
+    print('%-12s %8s %10s %10s %14s %14s' % ('backend', 'nprobe', 'build (s)', 'recall', 'batch (ms/q)',
+                                             'single (ms/q)'))
+    for backend in args.backends:
+        for nprobe in (args.nprobe if backend == 'ivf' else [None]):
+            options = {'num_lists': args.num_lists, 'nprobe': nprobe} if backend == 'ivf' else {}
+            start = time.time()
+            index = build_label_index(words, matrix, backend, metric=args.metric, **options)
+            build_time = time.time() - start
+            r = measure_index(index, exact_index, queries, args.top_k)
+            print('%-12s %8s %10.2f %10.4f %14.3f %14.3f' % (backend, nprobe or '-', build_time, r['recall'],
+                                                              1000 * r['batch_latency'],
+                                                              1000 * r['single_latency']))
@@ -0,0 +1,150 @@
+# Loss functions of the visual-semantic model.
+# The distance matrices between the output batch and all the labels are computed
+# with single matmul/broadcast kernels instead of one op per (sample, label) pair.
+import tensorflow as tf
+from training_utils import *
+
+LOSS_MARGIN = 0.1  # 1
+NEG_MARGIN = 1.5
+
+
+def pairwise_squared_distances(A, B):
+    """Creates the (len(A), len(B)) matrix of squared euclidean distances between the rows of A and B"""
+    sq_a = tf.reduce_sum(tf.square(A), axis=1, keepdims=True)
+    sq_b = tf.reduce_sum(tf.square(B), axis=1)
+    return tf.maximum(sq_a - 2 * tf.matmul(A, B, transpose_b=True) + sq_b, 0)
+
+
+def build_relevance_weights(target_labels, R):
+    """Creates the relevance matrix to be used in cost functions
+    That use the multiplicative term"""
+    return pairwise_squared_distances(target_labels, R) - NEG_MARGIN
+
+
+def build_diffs_cross_entropies(model_output, R):
+    """Create the cross entropy distance matrix (labels x batch)"""
+    return -tf.matmul(tf.nn.softmax(R), tf.nn.log_softmax(model_output), transpose_b=True)
+
+
+def build_diffs_eucli(model_output, R):
+    """Create the euclidean distance vector: for every label, the norm of the difference
+    between the whole output batch and that label"""
+    batch_size = tf.cast(tf.shape(model_output)[0], tf.float32)
+    sq_outputs = tf.reduce_sum(tf.square(model_output))
+    output_sum = tf.reduce_sum(model_output, axis=0, keepdims=True)
+    sq_diffs = (sq_outputs - 2 * tf.matmul(R, output_sum, transpose_b=True)[:, 0]
+                + batch_size * tf.reduce_sum(tf.square(R), axis=1))
+    return tf.sqrt(tf.maximum(sq_diffs, 0))
+
+
+def build_eucli_loss(model_output, target_labels, use_reg=True):
+    """Creates the euclidean based loss function"""
+    R = build_all_labels_repr()
+    proj1 = tf.norm(model_output - target_labels)
+    proj2 = (-1) * build_diffs_eucli(model_output, R)
+    proj_sum = proj1 + proj2
+    proj_mean = tf.reduce_mean(proj_sum)
+
+    reg_term = tf.norm(tf.reduce_mean(model_output, 0) - tf.reduce_mean(R, 0))
+    reg_relevance = 0.2
+
+    if not use_reg:
+        reg_relevance = 0
+    final_loss = proj_mean + reg_relevance * reg_term
+
+    return final_loss
+
+
+def build_cross_ent_loss(model_output, target_labels, use_reg=True):
+    """Create the cross entropy based loss function"""
+    R = build_all_labels_repr()
+    softmax_target_labels = tf.nn.softmax(target_labels)
+    proj1 = tf.nn.softmax_cross_entropy_with_logits(logits=model_output,
+                                                    labels=softmax_target_labels)
+    proj2 = (-1) * build_diffs_cross_entropies(model_output, R)
+    proj_sum = proj1 + proj2
+    proj_mean = tf.reduce_mean(proj_sum)
+    reg_term = tf.norm(tf.reduce_mean(model_output, 0) - tf.reduce_mean(R, 0))
+    reg_relevance = 0.2
+    if not use_reg:
+        reg_relevance = 0
+    final_loss = proj_mean + reg_relevance * reg_term
+    return final_loss
+
+
+def build_prod_loss(model_output, target_labels, use_reg=True):
+    """Create the original loss function used in the devise model + the custom regularization term"""
+    R = build_all_labels_repr()
+    proj1 = tf.diag_part(tf.matmul(model_output, tf.transpose(target_labels)))
+    sum1 = LOSS_MARGIN - proj1
+    sum2 = tf.matmul(model_output, tf.transpose(R))
+    sum3 = tf.transpose(sum1 + tf.transpose(sum2))
+    relu_sum3 = tf.nn.relu(sum3)
+    mean = tf.reduce_mean(relu_sum3)
+    reg_term = tf.norm(tf.reduce_mean(model_output, 0) - tf.reduce_mean(R, 0))
+    reg_relevance = 0.2
+    if not use_reg:
+        reg_relevance = 0
+
+    final_loss = mean + reg_relevance * reg_term
+    return final_loss
+
+
+def build_rel_w_prod_loss(model_output, target_labels, use_reg=True):
+    """Create the multiplicative term based loss function"""
+    R = build_all_labels_repr()
+    proj1 = tf.diag_part(tf.matmul(model_output, tf.transpose(target_labels)))
+    sum1 = LOSS_MARGIN - proj1
+    relevance_weights = build_relevance_weights(target_labels, R)
+
+    sum2 = tf.matmul(model_output, tf.transpose(R))
+    weighted_sum2 = tf.multiply(sum2, relevance_weights)
+    sum3 = tf.transpose(sum1 + tf.transpose(weighted_sum2))
+    relu_sum3 = tf.nn.relu(sum3)
+    mean = tf.reduce_mean(relu_sum3)
+    reg_term = tf.norm(tf.reduce_mean(model_output, 0) - tf.reduce_mean(R, 0))
+    reg_relevance = 0.2
+    if not use_reg:
+        reg_relevance = 0
+    final_loss = mean + reg_relevance * reg_term
+    return final_loss
+
+
+def build_no_margin_prod_loss(model_output, target_labels):
+    """Created the no margin loss function. Without a margin the products are unbounded,
+    so the regularization terms are always added"""
+    R = build_all_labels_repr()
+    proj1 = tf.diag_part(tf.matmul(model_output, tf.transpose(target_labels)))
+    sum1 = (-1) * proj1
+    sum2 = tf.matmul(model_output, tf.transpose(R))
+    sum3 = tf.transpose(sum1 + tf.transpose(sum2))
+    mean = tf.reduce_mean(sum3)
+    reg_term = tf.norm(tf.reduce_mean(model_output, 0) - tf.reduce_mean(R, 0))
+    variance = tf.pow(tf.reduce_mean(tf.norm(model_output, axis=1)) - tf.reduce_mean(tf.norm(R, axis=1)), 2)
+    reg_term2 = variance
+    final_loss = mean + 0.2 * reg_term + 0.8 * reg_term2
+    return final_loss
+
+
+LOSS_BUILDERS = {
+    'eucli': build_eucli_loss,
+    'cross_ent': build_cross_ent_loss,
+    'prod': build_prod_loss,
+    'rel_w_prod': build_rel_w_prod_loss,
+    'no_margin_prod': build_no_margin_prod_loss,
+}
+
+# Losses whose regularization can not be turned off (their builders take no use_reg argument)
+ALWAYS_REGULARIZED_LOSSES = ['no_margin_prod']
+
+
+def build_loss(name, model_output, target_labels, use_reg=True):
+    """Builds the loss function registered under name in LOSS_BUILDERS"""
+    if name not in LOSS_BUILDERS:
+        raise ValueError("Unknown loss '%s', should be one of: %s" % (name, ', '.join(sorted(LOSS_BUILDERS))))
+    if name in ALWAYS_REGULARIZED_LOSSES:
+        if not use_reg:
+            print("WARNING: the '%s' loss is unbounded without its regularization terms, they are added anyway" %
+                  name)
+        return LOSS_BUILDERS[name](model_output, target_labels)
+    return LOSS_BUILDERS[name](model_output, target_labels, use_reg=use_reg)
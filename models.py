@@ -4,6 +4,23 @@ import tensorflow as tf
 import numpy as np
 
 
+# Implementation of the convolutions with groups > 1:
+# 'split' runs one convolution per group, 'block_diagonal' a single one with block diagonal weights
+# (opt-in, check with benchmark_grouped_conv.py that it is faster on the target hardware)
+GROUPED_CONV = 'split'
+
+
+def block_diagonal_weights(weights, groups):
+    """Expands grouped conv weights [height, width, in_channels / groups, filters] to the
+    [height, width, in_channels, filters] weights of a single convolution, with zeros between groups"""
+    group_channels = int(weights.get_shape()[2])
+    num_filters = int(weights.get_shape()[3])
+    in_groups = np.arange(group_channels * groups) // group_channels
+    out_groups = np.arange(num_filters) // (num_filters // groups)
+    mask = (in_groups[:, np.newaxis] == out_groups).astype(np.float32)
+    return tf.tile(weights, [1, 1, groups, 1]) * mask
+
+
 def conv(x, filter_height, filter_width, num_filters, stride_y, stride_x, name,
          padding='SAME', groups=1, verbose_shapes=False, batch_norm=False):
     """Convolution function that can be split in multiple GPUs"""
@@ -20,13 +37,13 @@ def conv(x, filter_height, filter_width, num_filters, stride_y, stride_x, name,
     with tf.variable_scope(name) as scope:
         try:
             weights = tf.get_variable('weights',
-                                      shape=[filter_height, filter_width, input_channels / groups, num_filters],
+                                      shape=[filter_height, filter_width, input_channels // groups, num_filters],
                                       trainable=True,
                                       initializer=tf.contrib.layers.xavier_initializer())
         except:
             tf.get_variable_scope().reuse_variables()
             weights = tf.get_variable('weights',
-                                      shape=[filter_height, filter_width, input_channels / groups, num_filters],
+                                      shape=[filter_height, filter_width, input_channels // groups, num_filters],
                                       trainable=True,
                                       initializer=tf.contrib.layers.xavier_initializer())
 
@@ -40,14 +57,16 @@ def conv(x, filter_height, filter_width, num_filters, stride_y, stride_x, name,
 
         if groups == 1:
             conv = convolve(x, weights)
-        else:
+        elif GROUPED_CONV == 'split':
             input_groups = tf.split(axis=3, num_or_size_splits=groups, value=x)
             weight_groups = tf.split(axis=3, num_or_size_splits=groups, value=weights)
             output_groups = [convolve(i, k) for i, k in zip(input_groups, weight_groups)]
 
             conv = tf.concat(axis=3, values=output_groups)
+        else:
+            conv = convolve(x, block_diagonal_weights(weights, groups))
 
-        bias = tf.reshape(tf.nn.bias_add(conv, biases), conv.get_shape().as_list())
+        bias = tf.nn.bias_add(conv, biases)
         if batch_norm:
             norm = lrn(bias, 2, 2e-05, 0.75, name=scope.name)
             relu = tf.nn.relu(norm, name=scope.name)
@@ -121,8 +140,13 @@ def avg_pool(x, filter_height, filter_width, stride_y, stride_x,
 
 
 def normalize_images(x):
-    """Normalize images before feeding into a CNN"""
-    return tf.map_fn(lambda frame: tf.image.per_image_standardization(frame), x)
+    """Normalize images before feeding into a CNN.
+    Same as tf.image.per_image_standardization on every frame, computed for the whole batch at once"""
+    num_elements = tf.cast(tf.reduce_prod(tf.shape(x)[1:]), tf.float32)
+    mean = tf.reduce_mean(x, axis=[1, 2, 3], keepdims=True)
+    variance = tf.reduce_mean(tf.square(x - mean), axis=[1, 2, 3], keepdims=True)
+    adjusted_stddev = tf.maximum(tf.sqrt(variance), tf.rsqrt(num_elements))
+    return (x - mean) / adjusted_stddev
 
 
 def dropout(x, keep_prob):
@@ -131,10 +155,11 @@ def dropout(x, keep_prob):
 
 
 class AlexNet(object):
-    """AlexNet model"""
-    def __init__(self, x, num_classes):
+    """AlexNet model. with_classifier=False leaves out the fc5 classification head (for inference graphs)"""
+    def __init__(self, x, num_classes, with_classifier=True):
         self.X = x
         self.NUM_CLASSES = num_classes
+        self.WITH_CLASSIFIER = with_classifier
         self.create()
 
     def create(self):
@@ -158,20 +183,22 @@ class AlexNet(object):
 
         # 5th Layer: FC and return unscaled activations
         # (for tf.nn.softmax_cross_entropy_with_logits)
-        self.fc5 = fc(self.fc4, 192, self.NUM_CLASSES, relu=False, name='fc5')
+        if self.WITH_CLASSIFIER:
+            self.fc5 = fc(self.fc4, 192, self.NUM_CLASSES, relu=False, name='fc5')
 
 
 class Composite_model(object):
-    """Visual-semantic embedding"""
-    def __init__(self, x, num_classes, word2vec_size, use_vgg=False):
+    """Visual-semantic embedding. with_classifier=False leaves out the (unused) classification
+    head of the image model, as in the exported inference graphs"""
+    def __init__(self, x, num_classes, word2vec_size, use_vgg=False, with_classifier=True):
         self.X = x
         self.NUM_CLASSES = num_classes
         self.WORD2VEC_SIZE = word2vec_size
         self.use_vgg = use_vgg
         if self.use_vgg:
-            self.image_repr_model = VGG19(self.X, 0.5, self.NUM_CLASSES)
+            self.image_repr_model = VGG19(self.X, 0.5, self.NUM_CLASSES, with_classifier)
         else:
-            self.image_repr_model = AlexNet(self.X, self.NUM_CLASSES)
+            self.image_repr_model = AlexNet(self.X, self.NUM_CLASSES, with_classifier)
         self.create()
 
     def create(self):
@@ -200,11 +227,12 @@ class Reverse_model(object):
 
 
 class VGG19(object):
-    """VGG19 model"""
-    def __init__(self, x, keep_prob, num_classes):
+    """VGG19 model. with_classifier=False leaves out the fc8 classification head (for inference graphs)"""
+    def __init__(self, x, keep_prob, num_classes, with_classifier=True):
         self.X = x
         self.KEEP_PROB = keep_prob
         self.NUM_CLASSES = num_classes
+        self.WITH_CLASSIFIER = with_classifier
         self.create()
 
     def create(self):
@@ -235,4 +263,5 @@ class VGG19(object):
 
         fc6 = fc(flattened, flattened_shape, 4096, name='fc6')
         self.fc7 = fc(fc6, 4096, 4096, name='fc7')
-        self.fc8 = fc(self.fc7, 4096, self.NUM_CLASSES, relu=False, name='fc8')
+        if self.WITH_CLASSIFIER:
+            self.fc8 = fc(self.fc7, 4096, self.NUM_CLASSES, relu=False, name='fc8')
@@ -0,0 +1,138 @@
+# NumPy only forward pass of the AlexNet composite model (Composite_model with use_vgg=False).
+# The weights are exported once from a checkpoint to a .npz file; scoring workers then only
+# need numpy to compute the projection_layer outputs (no tensorflow import or session).
+import argparse
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from batch_making import adjust_batch
+
+IMAGE_SIZE = 24
+BATCH_SIZE = 256
+LAYERS = ['conv1', 'conv2', 'fc3', 'fc4', 'proj']
+CONV2_GROUPS = 2
+LRN_RADIUS = 2
+LRN_ALPHA = 2e-05
+LRN_BETA = 0.75
+LRN_BIAS = 1.0
+
+
+def export_numpy_weights(check_point_file, weights_file):
+    """Saves the weights and biases of the composite model layers from a checkpoint into a .npz file"""
+    import tensorflow as tf
+    reader = tf.train.NewCheckpointReader(check_point_file)
+    weights = {}
+    for layer in LAYERS:
+        for name in ['weights', 'biases']:
+            weights[layer + '/' + name] = reader.get_tensor(layer + '/' + name)
+    np.savez(weights_file, **weights)
+
+
+def normalize_images(x):
+    """Same as models.normalize_images (per image standardization)"""
+    num_elements = np.prod(x.shape[1:])
+    mean = np.mean(x, axis=(1, 2, 3), keepdims=True)
+    stddev = np.sqrt(np.mean(np.square(x - mean), axis=(1, 2, 3), keepdims=True))
+    return (x - mean) / np.maximum(stddev, 1 / np.sqrt(num_elements, dtype=np.float32))
+
+
+def conv2d(x, weights, biases, padding='SAME', groups=1):
+    """Stride 1 convolution (followed by bias and relu, as models.conv) computed as an im2col matrix product"""
+    filter_height, filter_width, group_channels, num_filters = weights.shape
+    if padding == 'SAME':
+        pad_y, pad_x = (filter_height - 1) // 2, (filter_width - 1) // 2
+        x = np.pad(x, ((0, 0), (pad_y, filter_height - 1 - pad_y), (pad_x, filter_width - 1 - pad_x), (0, 0)))
+    batch, height, width = x.shape[0], x.shape[1] - filter_height + 1, x.shape[2] - filter_width + 1
+    group_filters = num_filters // groups
+
+    outputs = []
+    for g in range(groups):
+        group_x = x[..., g * group_channels:(g + 1) * group_channels]
+        # (batch, height, width, channels, fh, fw) -> rows of (fh, fw, channels) patches, as the weights
+        patches = sliding_window_view(group_x, (filter_height, filter_width), axis=(1, 2))
+        patches = patches.transpose(0, 1, 2, 4, 5, 3).reshape(batch * height * width, -1)
+        group_weights = weights[..., g * group_filters:(g + 1) * group_filters].reshape(-1, group_filters)
+        outputs.append(np.dot(patches, group_weights))
+    output = outputs[0] if groups == 1 else np.concatenate(outputs, axis=1)
+    output = output.reshape(batch, height, width, num_filters) + biases
+    return np.maximum(output, 0)
+
+
+def lrn(x, radius=LRN_RADIUS, alpha=LRN_ALPHA, beta=LRN_BETA, bias=LRN_BIAS):
+    """Same as tf.nn.local_response_normalization. The squares are summed over the window of
+    channels with a product by a band matrix"""
+    num_channels = x.shape[3]
+    channels = np.arange(num_channels)
+    band = (np.abs(channels[:, np.newaxis] - channels) <= radius).astype(np.float32)
+    sq_sum = np.dot(np.square(x).reshape(-1, num_channels), band).reshape(x.shape)
+    return x / (bias + alpha * sq_sum) ** beta
+
+
+def max_pool(x, size=3, stride=2):
+    """VALID max pooling"""
+    windows = sliding_window_view(x, (size, size), axis=(1, 2))[:, ::stride, ::stride]
+    return windows.max(axis=(4, 5))
+
+
+def dense(x, weights, biases, relu=True):
+    output = np.dot(x, weights) + biases
+    return np.maximum(output, 0) if relu else output
+
+
+class NumpyProjector(object):
+    """Computes the projection_layer of the AlexNet composite model from exported weights"""
+    def __init__(self, weights_file, image_size=IMAGE_SIZE):
+        with np.load(weights_file) as weights:
+            self.weights = dict((name, weights[name].astype(np.float32)) for name in weights.files)
+        self.image_size = image_size
+
+    def __call__(self, images):
+        """Returns the (batch, word2vec_size) projections of an image batch"""
+        w = self.weights
+        x = normalize_images(np.asarray(adjust_batch(images, self.image_size), dtype=np.float32))
+
+        x = conv2d(x, w['conv1/weights'], w['conv1/biases'], padding='VALID')
+        x = max_pool(lrn(x))
+        x = conv2d(x, w['conv2/weights'], w['conv2/biases'], padding='SAME', groups=CONV2_GROUPS)
+        x = max_pool(lrn(x))
+
+        x = x.reshape(len(x), -1)
+        x = dense(x, w['fc3/weights'], w['fc3/biases'])
+        x = dense(x, w['fc4/weights'], w['fc4/biases'])
+        return dense(x, w['proj/weights'], w['proj/biases'], relu=False)
+
+    def project(self, images, batch_size=BATCH_SIZE):
+        """Returns the (N, word2vec_size) projections of the images"""
+        outputs = np.zeros((len(images), self.weights['proj/biases'].shape[0]), dtype=np.float32)
+        for i in range(0, len(images), batch_size):
+            outputs[i:i + batch_size] = self(images[i:i + batch_size])
+        return outputs
+
+
+def compare_with_tensorflow(check_point_file, weights_file, images, image_size=IMAGE_SIZE):
+    """Largest absolute difference between the numpy and the tensorflow projections"""
+    import tensorflow as tf
+    from embedding_cache import build_projection_graph, project_images
+    graph = tf.Graph()
+    with graph.as_default():
+        x, model_output, saver = build_projection_graph(image_size)
+        with tf.Session(graph=graph) as sess:
+            saver.restore(sess, check_point_file)
+            expected = project_images(sess, x, model_output, images)
+    return np.max(np.abs(NumpyProjector(weights_file, image_size).project(images) - expected))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Exports the weights of an AlexNet composite model checkpoint '
+                                                 'for the numpy inference engine')
+    parser.add_argument('checkpoint')
+    parser.add_argument('output', help='.npz file for the weights')
+    parser.add_argument('--check', type=int, default=0, metavar='N',
+                        help='Compare the projections of N zero shot images with the tensorflow model')
+    args = parser.parse_args()
+
+    export_numpy_weights(args.checkpoint, args.output)
+    if args.check:
+        from data_context import context
+        images = context.resized_dataset('not_target_test_data', IMAGE_SIZE).images[:args.check]
+        print('Max absolute difference with tensorflow: %g' % compare_with_tensorflow(args.checkpoint, args.output,
+                                                                                    images))
@@ -1,6 +1,7 @@
 import numpy as np
-import pickle
 from batch_making import *
+from data_context import context
+from label_index import top_k_indices, vocabulary_index
 
 classes = {
     '1': ['beaver', 'dolphin', 'otter', 'seal', 'whale'],
@@ -25,15 +26,10 @@ classes = {
     '20': ['mower', 'rocket', 'car', 'tank', 'tractor']
 }
 
-not_target_labels = ['baby', 'bear', 'beaver', 'bed', 'beetle', 'bowl', 'bridge',
-                     'bus', 'camel', 'can', 'caterpillar', 'clock', 'couch', 'crab',
-                     'dolphin', 'forest', 'fox', 'hamster', 'house', 'kangaroo', 'lamp',
-                     'lizard', 'man', 'maple', 'mouse', 'mower', 'orange', 'orchid', 'palm',
-                     'pear', 'pickup', 'plain', 'poppy', 'porcupine', 'ray', 'spider', 'tank',
-                     'tiger', 'trout', 'turtle']
+TOP_K = 5
+VOCABULARY_SIZE = 50000
 
-
-all_labels = pickle.load(open('pickle_files/all_labels.pickle', 'rb'))
+reverse_dic = {label: superclass for superclass in classes.keys() for label in classes[superclass]}
 
 
 def cosine_distance(v1, v2):
@@ -41,31 +37,109 @@ def cosine_distance(v1, v2):
     return 1 - np.dot(v1, v2) / (np.linalg.norm(v1) * np.linalg.norm(v2))
 
 
+class LabelRanker(object):
+    """Ranks batches of projections against a fixed set of labels.
+    The label embedding matrix is built once, so ranking a batch is a single matrix product"""
+    def __init__(self, labels):
+        self.labels = list(labels)
+        self.label_names = np.array(self.labels)
+        self.matrix = context.label_embeddings.vectors(self.labels)
+        self.sq_norms = np.sum(self.matrix ** 2, axis=1)
+        self.unit_matrix = self.matrix / np.sqrt(self.sq_norms)[:, np.newaxis]
+
+    def distances(self, vectors, metric='cosine'):
+        """Returns the (batch, labels) distance matrix between the vectors and every label"""
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        if metric == 'cosine':
+            norms = np.linalg.norm(vectors, axis=1)[:, np.newaxis]
+            return 1 - np.dot(vectors, self.unit_matrix.T) / norms
+        elif metric == 'euclidean':
+            sq_distances = (np.sum(vectors ** 2, axis=1)[:, np.newaxis]
+                            - 2 * np.dot(vectors, self.matrix.T) + self.sq_norms)
+            return np.sqrt(np.maximum(sq_distances, 0))
+        else:
+            raise ValueError("metric should be 'cosine' or 'euclidean'")
+
+    def top_k(self, vectors, k=5, metric='cosine'):
+        """Returns the indices of the k closest labels of each vector in a crescent distance order"""
+        return top_k_indices(self.distances(vectors, metric), k)
+
+    def closest_labels(self, vectors, k=5, metric='cosine'):
+        """Returns the names of the k closest labels of each vector in a crescent distance order"""
+        return self.label_names[self.top_k(vectors, k, metric)]
+
+
+def get_label_ranker(zero_shot_only=False):
+    """Returns the ranker over all labels or over the zero shot labels only"""
+    if zero_shot_only:
+        return context.cached('zero_shot_ranker', lambda: LabelRanker(context.not_target_labels))
+    return context.cached('all_labels_ranker', lambda: LabelRanker(context.all_labels))
+
+
+def get_vocabulary_index(vocabulary_size=VOCABULARY_SIZE, backend='exact', **options):
+    """Returns an index over the vocabulary_size most frequent glove words (plus the dataset labels).
+    backend is 'exact' or 'ivf' (approximate, see label_index)"""
+    name = 'vocabulary_index_%s_%d_%s' % (backend, vocabulary_size, sorted(options.items()))
+    labels = [normalize_label(L) for L in context.all_labels]
+    return context.cached(name, lambda: vocabulary_index(vocabulary_size, backend, labels, **options))
+
+
+def get_closest_vocabulary_words(vectors, k=5, vocabulary_size=VOCABULARY_SIZE, backend='exact', **options):
+    """Returns the k closest glove words of each vector in a crescent distance order (cossine by default)"""
+    return get_vocabulary_index(vocabulary_size, backend, **options).closest_words(vectors, k).tolist()
+
+
 def get_closest_words(vector, zero_shot_only=False):
     """Returns the closest words to a vector in a crescent distance order.
     Uses euclidean distance"""
-    all_distances = []
-    possible_labels = all_labels
-    if zero_shot_only:
-        possible_labels = not_target_labels
-
-    for label in possible_labels:
-        wv = find_word_vec(normalize_label(label))
-        all_distances.append([label, np.linalg.norm(vector - wv)])
-    sorted_dist = sorted(all_distances, key=lambda x: x[1])
-    return [s[0] for s in sorted_dist]
+    ranker = get_label_ranker(zero_shot_only)
+    return ranker.closest_labels(vector, len(ranker.labels), metric='euclidean')[0].tolist()
 
 
 def get_closest_words_cosine(vector, zero_shot_only=False):
     """Returns the closest words to a vector in a crescent distance order.
     Uses cossine distance"""
-    all_distances = []
-    possible_labels = all_labels
-    if zero_shot_only:
-        possible_labels = not_target_labels
+    ranker = get_label_ranker(zero_shot_only)
+    return ranker.closest_labels(vector, len(ranker.labels), metric='cosine')[0].tolist()
+
+
+def score_projections(outputs, label_names, k=TOP_K):
+    """Computes the quantitative results of projections whose correct labels are label_names.
+    Returns the per class dicts of get_results plus the overall metrics:
+    Top-k accuracy (all classes)
+    Top-k accuracy (zero shot only: ranking only the classes present in label_names)
+    Mean cosine distance to the correct class
+    Super class accuracy (of the closest class)
+    """
+    ranker = get_label_ranker()
+    label_index = {label: i for i, label in enumerate(ranker.labels)}
+    correct = np.array([label_index[L] for L in label_names])
+    num_labels = len(ranker.labels)
+    distances = ranker.distances(outputs, metric='cosine')
+
+    top_k = top_k_indices(distances, k)
+    hits = np.any(top_k == correct[:, np.newaxis], axis=1)
+
+    zero_shot_columns = np.unique(correct)
+    zero_shot_top_k = zero_shot_columns[top_k_indices(distances[:, zero_shot_columns], k)]
+    zero_shot_hits = np.any(zero_shot_top_k == correct[:, np.newaxis], axis=1)
+
+    correct_distances = distances[np.arange(len(correct)), correct]
+
+    superclasses = np.array([reverse_dic[normalize_label(L)] for L in ranker.labels])
+    superclass_hits = superclasses[top_k[:, 0]] == superclasses[correct]
+
+    counts = np.bincount(correct, minlength=num_labels)
+    present = counts > 0
+
+    def per_class(values):
+        class_means = np.bincount(correct, weights=values, minlength=num_labels)[present] / counts[present]
+        return dict(zip(np.array(ranker.labels)[present].tolist(), class_means.tolist()))
 
-    for label in possible_labels:
-        wv = find_word_vec(normalize_label(label))
-        all_distances.append([label, cosine_distance(vector, wv)])
-    sorted_dist = sorted(all_distances, key=lambda x: x[1])
-    return [s[0] for s in sorted_dist]
+    return {'distances': per_class(correct_distances),
+            'accuracies': per_class(hits),
+            'accuracies_superclass': per_class(superclass_hits),
+            'top_k_accuracy': np.mean(hits),
+            'zero_shot_top_k_accuracy': np.mean(zero_shot_hits),
+            'mean_distance': np.mean(correct_distances),
+            'superclass_accuracy': np.mean(superclass_hits)}
@@ -0,0 +1,161 @@
+# Post-training int8 quantization of the composite model projection network.
+# A frozen inference graph (see export_inference_graph) is converted to a TensorFlow Lite model
+# with int8 weights (one scale per output channel for the convolutions) and int8 activations,
+# whose ranges are calibrated on a slice of target_train_data. The report compares the speed,
+# size and zero-shot accuracy of the int8 model against the float graph.
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import tensorflow as tf
+from data_context import context
+from quantitative_utils import score_projections, TOP_K
+from export_inference_graph import export_inference_graph, InferenceModel, INPUT_NAME, OUTPUT_NAME, \
+    word2vec_size, IMAGE_SIZE
+
+CALIBRATION_SIZE = 500
+BATCH_SIZE = 256
+
+
+def calibration_images(image_size=IMAGE_SIZE, num_images=CALIBRATION_SIZE, seed=0):
+    """Random (fixed) sample of the known classes training images used to calibrate the activation ranges"""
+    images = context.resized_dataset('target_train_data', image_size).images
+    rng = np.random.RandomState(seed)
+    indices = np.sort(rng.choice(len(images), min(num_images, len(images)), replace=False))
+    return np.asarray(images[indices], dtype=np.float32)
+
+
+def quantize_inference_graph(graph_file, output_file, images, image_size=IMAGE_SIZE):
+    """Converts a frozen inference graph into an int8 TensorFlow Lite model calibrated on images"""
+    converter = tf.lite.TFLiteConverter.from_frozen_graph(graph_file, [INPUT_NAME], [OUTPUT_NAME],
+                                                          {INPUT_NAME: [1, image_size, image_size, 3]})
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = lambda: ([image[np.newaxis]] for image in images)
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    model = converter.convert()
+    with open(output_file, 'wb') as f:
+        f.write(model)
+    return model
+
+
+def batch_buckets(batch_size):
+    """Fixed batch sizes the inputs are padded to: the powers of two below batch_size and batch_size"""
+    buckets = []
+    size = 1
+    while size < batch_size:
+        buckets.append(size)
+        size *= 2
+    return buckets + [batch_size]
+
+
+class TFLiteProjector(object):
+    """Projects image batches with a (quantized) TensorFlow Lite model. The input and output stay float32.
+    Batches are padded to the next size of batch_buckets(batch_size), each one with its own interpreter,
+    so the tensors are only allocated the first time a size is used (and larger batches are split)"""
+    def __init__(self, model_file, num_threads=None, batch_size=BATCH_SIZE):
+        self.model_file = model_file
+        self.num_threads = num_threads
+        self.buckets = batch_buckets(batch_size)
+        self.interpreters = {}
+
+    def interpreter(self, input_shape):
+        """Returns the (interpreter, input index, output index) allocated for an input shape"""
+        if input_shape not in self.interpreters:
+            if self.num_threads:
+                interpreter = tf.lite.Interpreter(model_path=self.model_file, num_threads=self.num_threads)
+            else:
+                interpreter = tf.lite.Interpreter(model_path=self.model_file)
+            input_index = interpreter.get_input_details()[0]['index']
+            interpreter.resize_tensor_input(input_index, list(input_shape))
+            interpreter.allocate_tensors()
+            self.interpreters[input_shape] = (interpreter, input_index, interpreter.get_output_details()[0]['index'])
+        return self.interpreters[input_shape]
+
+    def __call__(self, images):
+        images = np.asarray(images, dtype=np.float32)
+        outputs = []
+        for i in range(0, len(images), self.buckets[-1]):
+            batch = images[i:i + self.buckets[-1]]
+            size = self.buckets[np.searchsorted(self.buckets, len(batch))]
+            if size > len(batch):
+                batch = np.concatenate([batch, np.zeros((size - len(batch),) + batch.shape[1:], dtype=np.float32)])
+            interpreter, input_index, output_index = self.interpreter(batch.shape)
+            interpreter.set_tensor(input_index, batch)
+            interpreter.invoke()
+            outputs.append(interpreter.get_tensor(output_index)[:len(images) - i].copy())
+        return np.concatenate(outputs)
+
+    def project(self, images, batch_size=BATCH_SIZE):
+        """Returns the (N, word2vec_size) projections of the images"""
+        outputs = np.zeros((len(images), word2vec_size), dtype=np.float32)
+        for i in range(0, len(images), batch_size):
+            outputs[i:i + batch_size] = self(images[i:i + batch_size])
+        return outputs
+
+
+def timed_projection(project, images, batch_size=BATCH_SIZE):
+    """Returns the projections and the images per second of a project(images, batch_size) function"""
+    project(images[:batch_size], batch_size)
+    start = time.time()
+    outputs = project(images, batch_size)
+    return outputs, len(images) / (time.time() - start)
+
+
+def compare_models(graph_file, tflite_file, data, batch_size=BATCH_SIZE, num_threads=None, k=TOP_K):
+    """Runs the float graph and the int8 model over a columnar dataset and returns their metrics"""
+    images = np.asarray(data.images, dtype=np.float32)
+    label_names = data.fine_names().tolist()
+
+    float_model = InferenceModel(graph_file)
+    float_outputs, float_speed = timed_projection(float_model.project, images, batch_size)
+    float_model.close()
+
+    int8_model = TFLiteProjector(tflite_file, num_threads)
+    int8_outputs, int8_speed = timed_projection(int8_model.project, images, batch_size)
+
+    report = {}
+    for name, model_file, outputs, speed in [('float32', graph_file, float_outputs, float_speed),
+                                             ('int8', tflite_file, int8_outputs, int8_speed)]:
+        results = score_projections(outputs, label_names, k)
+        report[name] = {'size': os.path.getsize(model_file), 'images_per_second': speed,
+                        'top_k_accuracy': results['top_k_accuracy'],
+                        'zero_shot_top_k_accuracy': results['zero_shot_top_k_accuracy'],
+                        'mean_distance': results['mean_distance']}
+    cosines = np.sum(float_outputs * int8_outputs, axis=1) / (np.linalg.norm(float_outputs, axis=1) *
+                                                              np.linalg.norm(int8_outputs, axis=1))
+    report['int8']['cosine_to_float'] = np.mean(cosines)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='int8 post-training quantization of the composite model')
+    parser.add_argument('model', help='Composite model checkpoint or frozen inference graph (.pb)')
+    parser.add_argument('output', help='.tflite file for the int8 model')
+    parser.add_argument('--image-size', type=int, default=IMAGE_SIZE)
+    parser.add_argument('--calibration-size', type=int, default=CALIBRATION_SIZE)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--num-threads', type=int)
+    parser.add_argument('--top-k', type=int, default=TOP_K)
+    args = parser.parse_args()
+
+    graph_file = args.model
+    if not graph_file.endswith('.pb'):
+        graph_file = os.path.join(tempfile.mkdtemp(), 'inference_graph.pb')
+        export_inference_graph(args.model, graph_file, args.image_size)
+
+    quantize_inference_graph(graph_file, args.output, calibration_images(args.image_size, args.calibration_size),
+                             args.image_size)
+
+    data = (context.resized_dataset('not_target_train_data', args.image_size) +
+            context.resized_dataset('not_target_test_data', args.image_size))
+    report = compare_models(graph_file, args.output, data, args.batch_size, args.num_threads, args.top_k)
+
+    print('%-8s %10s %10s %10s %16s %14s' % ('model', 'size (MB)', 'images/s', 'top-%d' % args.top_k,
+                                             'zero shot top-%d' % args.top_k, 'mean distance'))
+    for name in ['float32', 'int8']:
+        r = report[name]
+        print('%-8s %10.2f %10.0f %10.4f %16.4f %14.4f' % (name, r['size'] / 2.0 ** 20, r['images_per_second'],
+                                                         r['top_k_accuracy'], r['zero_shot_top_k_accuracy'],
+                                                         r['mean_distance']))
+    print('Mean cosine similarity between the int8 and float32 projections: %.4f' % report['int8']['cosine_to_float'])
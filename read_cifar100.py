@@ -1,13 +1,23 @@
 # This code reads cifar-100 dataset and picks the first three
 # Classes for each superclass to enter the training procedure (target data)
 # The other two labels will be used for zero-shot learning.
+# (the number of zero-shot classes per superclass can be changed with --num-zero-shot)
 
+import argparse
+import numpy as np
+import os
 import pickle
 import random
 from sklearn.preprocessing import LabelBinarizer
+from label_embeddings import *
+from columnar_dataset import *
+from img_util import image_arrays_to_image_matrices
+from data_context import PICKLE_FOLDER
 
 random.seed(0)
 
+NUM_ZERO_SHOT_PER_SUPERCLASS = 2
+
 
 def read_pickle_file(filename):
     """Reads a pickle file using the latin1 encoding"""
@@ -18,64 +28,54 @@ def read_pickle_file(filename):
     return p
 
 
-def separate_target_data(cifar_dict, used_labels):
-    """Separate classes to be used in zero shot inference using the CIFAR-100 superclasses"""
-    # FORMAT: DATA, FINE_LABEL, COARSE_LABEL
-    target_data = []
-    not_target_data = []
-
-    len_data = len(cifar_dict['data'])
-
-    for i in range(len_data):
-        new_entry = [cifar_dict['data'][i], cifar_dict['fine_labels'][i],
-                     cifar_dict['coarse_labels'][i]]
-
-        fine = cifar_dict['fine_labels'][i]
-        if fine in used_labels:
-            target_data.append(new_entry)
-        else:
-            not_target_data.append(new_entry)
+def create_columnar_dataset(cifar_dict, metadata_dic):
+    """Create a columnar (images, fine_labels, coarse_labels) dataset with the label name tables.
+    The CIFAR CHW flat images are converted to HWC"""
+    images = image_arrays_to_image_matrices(np.asarray(cifar_dict['data'], dtype=np.uint8))
+    fine_labels = np.asarray(cifar_dict['fine_labels'], dtype=np.int32)
+    coarse_labels = np.asarray(cifar_dict['coarse_labels'], dtype=np.int32)
+    return ColumnarDataset(np.ascontiguousarray(images), fine_labels, coarse_labels,
+                           metadata_dic['fine_label_names'], metadata_dic['coarse_label_names'])
 
-    return {'target': target_data, 'not_target': not_target_data}
 
+def separate_target_data(cifar_dict, used_labels, metadata_dic):
+    """Separate classes to be used in zero shot inference using the CIFAR-100 superclasses"""
+    dataset = create_columnar_dataset(cifar_dict, metadata_dic)
+    target_mask = np.isin(dataset.fine_labels, used_labels)
 
-def create_dataset_with_string_labels(dataset, metadata_dic):
-    """Create a (image, fine_label, coarse_label) dataset"""
-    new_dataset = []
-    for d in dataset:
-        fine_label = d[1]
-        coarse_label = d[2]
-        fine_name = metadata_dic['fine_label_names'][fine_label]
-        coarse_name = metadata_dic['coarse_label_names'][coarse_label]
-        new_dataset.append([d[0], fine_name, coarse_name])
-    return new_dataset
+    return {'target': dataset[target_mask], 'not_target': dataset[~target_mask]}
 
 
 def build_coarse_to_fine_correspondence(cifar_dict):
-    """Create fine labels groups by superclass"""
-    num_coarse = len(set(cifar_dict['coarse_labels']))
-    corrs_coarse_fine = []
-    for i in range(num_coarse):
-        corrs_coarse_fine.append([])
-
-    len_dict = len(cifar_dict['data'])
-
-    for i in range(len_dict):
-        coarse = cifar_dict['coarse_labels'][i]
-        fine = cifar_dict['fine_labels'][i]
-        if fine not in corrs_coarse_fine[coarse]:
-            corrs_coarse_fine[coarse].append(fine)
-
-    return corrs_coarse_fine
-
-
-def separated_used_labels(coarse_to_fine_correspondence):
-    """Within a superclass, separate zero shot and training labels"""
+    """Create fine labels groups by superclass, keeping the order in which the fine labels appear"""
+    fine = np.asarray(cifar_dict['fine_labels'])
+    coarse = np.asarray(cifar_dict['coarse_labels'])
+
+    unique_fine, first_index = np.unique(fine, return_index=True)
+    appearance_order = np.argsort(first_index)
+    fine_in_order = unique_fine[appearance_order]
+    coarse_in_order = coarse[first_index[appearance_order]]
+
+    num_coarse = len(np.unique(coarse))
+    by_coarse = np.argsort(coarse_in_order, kind='stable')
+    group_sizes = np.bincount(coarse_in_order, minlength=num_coarse)
+    groups = np.split(fine_in_order[by_coarse], np.cumsum(group_sizes)[:-1])
+
+    return [g.tolist() for g in groups]
+
+
+def separated_used_labels(coarse_to_fine_correspondence, num_zero_shot=NUM_ZERO_SHOT_PER_SUPERCLASS):
+    """Within a superclass, separate zero shot and training labels.
+    The last num_zero_shot classes of each superclass are held out for zero shot"""
+    smallest = min(len(fine_labels) for fine_labels in coarse_to_fine_correspondence)
+    if not 0 < num_zero_shot < smallest:
+        raise ValueError('num_zero_shot should be between 1 and %d (every superclass needs zero shot '
+                         'and training labels), got %d' % (smallest - 1, num_zero_shot))
     used_labels = []
     all_labels = []
 
     for fine_labels in coarse_to_fine_correspondence:
-        used_labels = used_labels + fine_labels[:3]  # Pick the first three classes for target
+        used_labels = used_labels + fine_labels[:len(fine_labels) - num_zero_shot]
         all_labels = all_labels + fine_labels
 
     return [all_labels, used_labels]
@@ -84,6 +84,13 @@ def separated_used_labels(coarse_to_fine_correspondence):
 # READING CIFAR 100 DATA
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Create the target and zero shot datasets from CIFAR-100')
+    parser.add_argument('--num-zero-shot', type=int, default=NUM_ZERO_SHOT_PER_SUPERCLASS,
+                        help='Number of classes held out for zero shot in each superclass')
+    parser.add_argument('--output-folder', default=PICKLE_FOLDER)
+    args = parser.parse_args()
+    output_folder = args.output_folder
+
     #Create datasets
     cifar_train_dict = read_pickle_file('cifar-100-python/train')
     cifar_test_dict = read_pickle_file('cifar-100-python/test')
@@ -94,54 +101,41 @@ if __name__ == '__main__':
     print('CALCULATING CORRESPONDENCE')
 
     corrs_coarse_fine = build_coarse_to_fine_correspondence(cifar_train_dict)
-    [all_labels, used_labels] = separated_used_labels(corrs_coarse_fine)
+    [all_labels, used_labels] = separated_used_labels(corrs_coarse_fine, args.num_zero_shot)
     used_labels_str = [cifar_meta['fine_label_names'][L] for L in used_labels]
     all_labels_str = [cifar_meta['fine_label_names'][L] for L in all_labels]
+    not_target_labels_str = sorted(set(all_labels_str) - set(used_labels_str))
     print('USED LABELS %d:' % len(used_labels_str), set(used_labels_str))
     print('ALL LABELS %d' % len(all_labels_str), set(all_labels_str))
 
     print('CORRESPONDENCE DONE')
 
-    separated_train_data = separate_target_data(cifar_train_dict, used_labels)
-    separated_test_data = separate_target_data(cifar_test_dict, used_labels)
-
-    target_train_data = separated_train_data['target']
-    target_test_data = separated_test_data['target']
-
-    not_target_train_data = separated_train_data['not_target']
-    not_target_test_data = separated_test_data['not_target']
+    separated_train_data = separate_target_data(cifar_train_dict, used_labels, cifar_meta)
+    separated_test_data = separate_target_data(cifar_test_dict, used_labels, cifar_meta)
 
     vectorizer = LabelBinarizer()
     vectorizer.fit(used_labels_str)
 
-    print('BUILDING DATASET WITH STR LABELS FOR NEW NORMALIZATION')
-    str_target_train_data = create_dataset_with_string_labels(target_train_data, cifar_meta)
-    str_not_target_train_data = create_dataset_with_string_labels(not_target_train_data, cifar_meta)
+    print('SAVING...')
+    if not os.path.isdir(output_folder): os.mkdir(output_folder)
+    save_columnar_dataset(separated_train_data['target'], os.path.join(output_folder, 'target_train_data'))
+    save_columnar_dataset(separated_test_data['target'], os.path.join(output_folder, 'target_test_data'))
+    save_columnar_dataset(separated_train_data['not_target'], os.path.join(output_folder, 'not_target_train_data'))
+    save_columnar_dataset(separated_test_data['not_target'], os.path.join(output_folder, 'not_target_test_data'))
 
-    str_target_test_data = create_dataset_with_string_labels(target_test_data, cifar_meta)
-    str_not_target_test_data = create_dataset_with_string_labels(not_target_test_data, cifar_meta)
+    out_all_labels = open(os.path.join(output_folder, 'all_labels.pickle'), 'wb')
+    out_not_target_labels = open(os.path.join(output_folder, 'not_target_labels.pickle'), 'wb')
+    out_vectorizer = open(os.path.join(output_folder, 'vectorizer.pickle'), 'wb')
 
-    print('SAVING...')
-    out_target_train = open('pickle_files/target_train_data.pickle', 'wb')
-    out_target_test = open('pickle_files/target_test_data.pickle', 'wb')
-    out_not_target_train = open('pickle_files/not_target_train_data.pickle', 'wb')
-    out_not_target_test = open('pickle_files/not_target_test_data.pickle', 'wb')
-    out_all_labels = open('pickle_files/all_labels.pickle', 'wb')
-
-    out_vectorizer = open('pickle_files/vectorizer.pickle', 'wb')
-
-    pickle.dump(str_target_train_data, out_target_train)
-    pickle.dump(str_target_test_data, out_target_test)
-    pickle.dump(str_not_target_train_data, out_not_target_train)
-    pickle.dump(str_not_target_test_data, out_not_target_test)
     pickle.dump(vectorizer, out_vectorizer)
     pickle.dump(all_labels_str, out_all_labels)
+    pickle.dump(not_target_labels_str, out_not_target_labels)
 
-    out_target_train.close()
-    out_target_test.close()
-    out_not_target_train.close()
-    out_not_target_test.close()
     out_vectorizer.close()
+    out_not_target_labels.close()
     out_all_labels.close()
 
+    print('BUILDING LABEL EMBEDDINGS')
+    save_label_embeddings(build_label_embeddings(all_labels_str), os.path.join(output_folder, LABEL_EMBEDDINGS_FILE))
+
     print('DONE!')
@@ -0,0 +1,118 @@
+# Checks the vectorized distance matrices of losses.py against the original
+# per (sample, label) formulations and builds every registered loss.
+# pytest runs small sizes, python test_losses.py also times the graph builds at the training sizes.
+import time
+import numpy as np
+import tensorflow as tf
+from losses import *
+from benchmark_losses import use_synthetic_labels
+
+
+def loop_build_relevance_weights(target_labels, R, batch_size):
+    t_splits = tf.split(target_labels, batch_size, axis=0)
+    R_splits = tf.split(R, int(R.get_shape()[0]), axis=0)
+    diffs = []
+    for t in t_splits:
+        new_diff_array = []
+        for r in R_splits:
+            new_norm = tf.pow(tf.norm(t - r), 2) - NEG_MARGIN
+            new_diff_array.append(new_norm)
+        diffs.append(new_diff_array)
+    return tf.convert_to_tensor(diffs)
+
+
+def loop_build_diffs_cross_entropies(model_output, R, batch_size):
+    R_splits = tf.split(R, int(R.get_shape()[0]), axis=0)
+    diffs = []
+    for r in R_splits:
+        r_softmax = tf.nn.softmax(r)
+        repeated_r_softmax = tf.reshape(tf.stack([r_softmax] * batch_size), model_output.get_shape())
+        cross_entropies = tf.nn.softmax_cross_entropy_with_logits(logits=model_output,
+                                                                  labels=repeated_r_softmax)
+        diffs.append(cross_entropies)
+    return tf.convert_to_tensor(diffs)
+
+
+def loop_build_diffs_eucli(model_output, R, batch_size):
+    R_splits = tf.split(R, int(R.get_shape()[0]), axis=0)
+    diffs = []
+    for r in R_splits:
+        repeated_r = tf.reshape(tf.stack([r] * batch_size), model_output.get_shape())
+        diffs.append(tf.norm(model_output - repeated_r))
+    return tf.convert_to_tensor(diffs)
+
+
+def check_equivalence(batch_size=128, num_labels=100, tolerance=1e-4):
+    """Compares the vectorized distance matrices with the original formulations on random data"""
+    rng = np.random.RandomState(0)
+    output_value = rng.normal(size=(batch_size, word2vec_size)).astype(np.float32) / 10
+    target_value = rng.normal(size=(batch_size, word2vec_size)).astype(np.float32) / 10
+    R_value = rng.normal(size=(num_labels, word2vec_size)).astype(np.float32) / 10
+
+    graph = tf.Graph()
+    with graph.as_default():
+        model_output = tf.constant(output_value)
+        target_labels = tf.constant(target_value)
+        R = tf.constant(R_value)
+        pairs = []
+        for name, vectorized, loop, args in [
+                ('relevance_weights', build_relevance_weights, loop_build_relevance_weights, (target_labels, R)),
+                ('diffs_cross_entropies', build_diffs_cross_entropies, loop_build_diffs_cross_entropies,
+                 (model_output, R)),
+                ('diffs_eucli', build_diffs_eucli, loop_build_diffs_eucli, (model_output, R))]:
+            start = time.time()
+            loop_tensor = loop(*(args + (batch_size,)))
+            loop_build_time = time.time() - start
+            start = time.time()
+            vectorized_tensor = vectorized(*args)
+            vectorized_build_time = time.time() - start
+            pairs.append([name, vectorized_tensor, loop_tensor, vectorized_build_time, loop_build_time])
+
+    all_equal = True
+    with tf.Session(graph=graph) as sess:
+        for name, vectorized_tensor, loop_tensor, vectorized_build_time, loop_build_time in pairs:
+            vectorized_value, loop_value = sess.run([vectorized_tensor, loop_tensor])
+            max_diff = np.max(np.abs(vectorized_value - loop_value) / (1 + np.abs(loop_value)))
+            equal = vectorized_value.shape == loop_value.shape and max_diff < tolerance
+            all_equal = all_equal and equal
+            print('%s: max relative difference %.2e, build time %.3fs (loop %.3fs) %s' %
+                  (name, max_diff, vectorized_build_time, loop_build_time, 'OK' if equal else 'MISMATCH'))
+    return all_equal
+
+
+def check_loss_builders(batch_size=8, num_labels=10):
+    """Builds every loss of LOSS_BUILDERS, with and without regularization, on random outputs and
+    synthetic label embeddings. Returns the (name, use_reg) pairs whose loss is not a finite scalar"""
+    rng = np.random.RandomState(0)
+    use_synthetic_labels(num_labels, rng)
+    output_value = rng.normal(size=(batch_size, word2vec_size)).astype(np.float32) / 10
+    target_value = rng.normal(size=(batch_size, word2vec_size)).astype(np.float32) / 10
+
+    failures = []
+    for name in sorted(LOSS_BUILDERS):
+        for use_reg in [True, False]:
+            graph = tf.Graph()
+            with graph.as_default():
+                loss = build_loss(name, tf.constant(output_value), tf.constant(target_value), use_reg=use_reg)
+                with tf.Session(graph=graph) as sess:
+                    value = sess.run(loss)
+            if np.shape(value) != () or not np.isfinite(value):
+                failures.append((name, use_reg))
+            print('%s (use_reg=%s): %s' % (name, use_reg, value))
+    return failures
+
+
+def test_vectorized_losses():
+    assert check_equivalence(batch_size=8, num_labels=10)
+
+
+def test_loss_builders():
+    assert check_loss_builders() == []
+
+
+if __name__ == '__main__':
+    if not check_equivalence():
+        raise SystemExit('Vectorized losses do not match the original formulations')
+    failures = check_loss_builders()
+    if failures:
+        raise SystemExit('Losses that are not finite scalars: %s' % failures)
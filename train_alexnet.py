@@ -7,6 +7,7 @@ import os
 from datetime import datetime
 from models import AlexNet
 from batch_making import *
+from data_context import context
 from training_utils import *
 
 initial_learning_rate = 0.1
@@ -26,13 +27,16 @@ checkpoint_path = 'checkpoints/'
 IMAGE_SIZE = 24
 OUTPUT_FILE_NAME = 'train_output.txt'
 
-decay_steps = int(len(target_train_data)/batch_size)
+train_data = context.resized_dataset('target_train_data', IMAGE_SIZE)
+test_data = context.resized_dataset('target_test_data', IMAGE_SIZE)
+
+decay_steps = int(len(train_data)/batch_size)
 learning_rate_decay_factor = 0.95
 
 if not os.path.isdir(filewriter_path): os.mkdir(filewriter_path)
 if not os.path.isdir(checkpoint_path): os.mkdir(checkpoint_path)
 
-x = tf.placeholder(tf.float32, [batch_size, IMAGE_SIZE, IMAGE_SIZE, 3])
+x = tf.placeholder(tf.float32, [None, IMAGE_SIZE, IMAGE_SIZE, 3])
 y = tf.placeholder(tf.float32, [None, num_classes])
 
 model = AlexNet(x, num_classes)
@@ -40,7 +44,7 @@ score = model.fc5
 
 var_list = [v for v in tf.trainable_variables() if v.name.split('/')[0] in train_layers]
 
-initial_x_batch = tf.placeholder(tf.float32, [batch_size, IMAGE_SIZE, IMAGE_SIZE, 3])
+initial_x_batch = tf.placeholder(tf.float32, [None, IMAGE_SIZE, IMAGE_SIZE, 3])
 dist_x_batch = distorted_batch(initial_x_batch, IMAGE_SIZE)
 
 with tf.name_scope("cross_ent"):
@@ -71,8 +75,8 @@ with tf.name_scope('accuracy'):
 saver = tf.train.Saver()
 
 # Initalize the data generator seperately for the training and validation set
-train_generator = get_batches(target_train_data, batch_size, IMAGE_SIZE)
-val_generator = get_batches(target_test_data, batch_size, IMAGE_SIZE)
+train_generator = prefetch_batches(train_data, batch_size, IMAGE_SIZE)
+val_generator = prefetch_batches(test_data, batch_size, IMAGE_SIZE)
 
 # Start Tensorflow session
 with tf.Session() as sess:
@@ -123,8 +127,8 @@ with tf.Session() as sess:
     print_in_file("Validation Accuracy (k-top) = %s %.4f" % (datetime.now(), test_acc_k))
 
     # Reset the file pointer of the image data generator
-    train_generator = get_batches(target_train_data, batch_size, IMAGE_SIZE)
-    val_generator = get_batches(target_test_data, batch_size, IMAGE_SIZE)
+    train_generator = prefetch_batches(train_data, batch_size, IMAGE_SIZE)
+    val_generator = prefetch_batches(test_data, batch_size, IMAGE_SIZE)
 
     print_in_file("{} Saving checkpoint of model...".format(datetime.now()), OUTPUT_FILE_NAME)
 
@@ -1,5 +1,6 @@
 # Partialy based on https://kratzert.github.io/2017/02/24/finetuning-alexnet-with-tensorflow.html
 # Code to train the visual-semantic model
+import argparse
 import tensorflow as tf
 import numpy as np
 import pickle
@@ -8,7 +9,15 @@ import os
 from datetime import datetime
 from models import Composite_model
 from batch_making import *
+from data_context import context
 from training_utils import *
+from losses import *
+
+parser = argparse.ArgumentParser(description='Train the visual-semantic model')
+parser.add_argument('--loss', default='eucli', choices=sorted(LOSS_BUILDERS.keys()))
+parser.add_argument('--use-reg', action='store_true', help='Add the regularization term of the loss '
+                                                          '(always added for no_margin_prod)')
+args = parser.parse_args()
 
 initial_learning_rate = 0.01
 momentum = 0.9
@@ -27,166 +36,37 @@ checkpoint_path = 'checkpoints_composite/'
 
 IMAGE_SIZE = 24
 OUTPUT_FILE_NAME = 'train_output.txt'
-LOSS_MARGIN = 0.1  # 1
+USE_TF_DATA = True  # Feed the model with the tf.data InputPipeline instead of placeholders
+
+train_data = context.resized_dataset('target_train_data', IMAGE_SIZE)
+test_data = context.resized_dataset('target_test_data', IMAGE_SIZE)
 
-decay_steps = int(len(target_train_data) / batch_size)
+decay_steps = int(len(train_data) / batch_size)
 learning_rate_decay_factor = 0.95
 
 if not os.path.isdir(filewriter_path): os.mkdir(filewriter_path)
 if not os.path.isdir(checkpoint_path): os.mkdir(checkpoint_path)
 
-x = tf.placeholder(tf.float32, [batch_size, IMAGE_SIZE, IMAGE_SIZE, 3])
-y = tf.placeholder(tf.float32, [batch_size, word2vec_size])
+if USE_TF_DATA:
+    input_pipeline = InputPipeline(batch_size, IMAGE_SIZE, context.label_embeddings.matrix)
+    x = input_pipeline.x
+    y = input_pipeline.y
+else:
+    x = tf.placeholder(tf.float32, [None, IMAGE_SIZE, IMAGE_SIZE, 3])
+    y = tf.placeholder(tf.float32, [None, word2vec_size])
+
+# The training batches are distorted inside the graph, right before the model
+is_training = tf.placeholder_with_default(False, [], name='is_training')
+model_input = augment_images(x, is_training)
 
-model = Composite_model(x, num_classes, word2vec_size)
+model = Composite_model(model_input, num_classes, word2vec_size)
 model_output = model.projection_layer
 
 var_list = [v for v in tf.trainable_variables()]
 
-initial_x_batch = tf.placeholder(tf.float32, [batch_size, IMAGE_SIZE, IMAGE_SIZE, 3])
-dist_x_batch = distorted_batch(initial_x_batch, IMAGE_SIZE)
-
-
-def build_relevance_weights(target_labels, R):
-    """Creates the relevance matrix to be used in cost functions
-    That use the multiplicative term"""
-    NEG_MARGIN = 1.5
-    t_splits = tf.split(target_labels, batch_size, axis=0)
-    R_splits = tf.split(R, len(all_labels), axis=0)
-    diffs = []
-    for t in t_splits:
-        new_diff_array = []
-        for r in R_splits:
-            new_norm = tf.pow(tf.norm(t - r), 2) - NEG_MARGIN
-            new_diff_array.append(new_norm)
-        diffs.append(new_diff_array)
-    diff_tensor = tf.convert_to_tensor(diffs)
-    return diff_tensor
-
-
-def build_diffs_cross_entropies(model_output, R):
-    """Create the cross entropy distance matrix"""
-    R_splits = tf.split(R, len(all_labels), axis=0)
-    diffs = []
-
-    for r in R_splits:
-        r_softmax = tf.nn.softmax(r)
-        repeated_r_softmax = tf.reshape(tf.stack([r_softmax] * batch_size), model_output.get_shape())
-        cross_entropies = tf.nn.softmax_cross_entropy_with_logits(logits=model_output,
-                                                                  labels=repeated_r_softmax)
-        diffs.append(cross_entropies)
-    diff_tensor = tf.convert_to_tensor(diffs)
-    return diff_tensor
-
-
-def build_diffs_eucli(model_output, R):
-    """Create the euclidean distance matrix"""
-    R_splits = tf.split(R, len(all_labels), axis=0)
-    diffs = []
-
-    for r in R_splits:
-        repeated_r = tf.reshape(tf.stack([r] * batch_size), model_output.get_shape())
-        new_diffs = tf.norm(model_output - repeated_r)
-        diffs.append(new_diffs)
-    diff_tensor = tf.convert_to_tensor(diffs)
-    return diff_tensor
-
-
-def build_eucli_loss(model_output, target_labels, use_reg=True):
-    """Creates the euclidean based loss function"""
-    R = build_all_labels_repr()
-    proj1 = tf.norm(model_output - target_labels)
-    proj2 = (-1) * build_diffs_eucli(model_output, R)
-    proj_sum = proj1 + proj2
-    proj_mean = tf.reduce_mean(proj_sum)
-
-    reg_term = tf.norm(tf.reduce_mean(model_output, 0) - tf.reduce_mean(R, 0))
-    reg_relevance = 0.2
-
-    if not use_reg:
-        reg_relevance = 0
-    final_loss = proj_mean + reg_relevance * reg_term
-
-    return final_loss
-
-
-def build_cross_ent_loss(model_output, target_labels, use_reg=True):
-    """Create the cross entropy based loss function"""
-    R = build_all_labels_repr()
-    softmax_target_labels = tf.nn.softmax(target_labels)
-    proj1 = tf.nn.softmax_cross_entropy_with_logits(logits=model_output,
-                                                    labels=softmax_target_labels)
-    proj2 = (-1) * build_diffs_cross_entropies(model_output, R)
-    proj_sum = proj1 + proj2
-    proj_mean = tf.reduce_mean(proj_sum)
-    reg_term = tf.norm(tf.reduce_mean(model_output, 0) - tf.reduce_mean(R, 0))
-    reg_relevance = 0.2
-    if not use_reg:
-        reg_relevance = 0
-    final_loss = proj_mean + reg_relevance * reg_term
-    return final_loss
-
-
-def build_prod_loss(model_output, target_labels, use_reg=True):
-    """Create the original loss function used in the devise model + the custom regularization term"""
-    R = build_all_labels_repr()
-    proj1 = tf.diag_part(tf.matmul(model_output, tf.transpose(target_labels)))
-    sum1 = LOSS_MARGIN - proj1
-    sum2 = tf.matmul(model_output, tf.transpose(R))
-    sum3 = tf.transpose(sum1 + tf.transpose(sum2))
-    relu_sum3 = tf.nn.relu(sum3)
-    mean = tf.reduce_mean(relu_sum3)
-    reg_term = tf.norm(tf.reduce_mean(model_output, 0) - tf.reduce_mean(R, 0))
-    reg_relevance = 0.2
-    if not use_reg:
-        reg_relevance = 0
-
-    final_loss = mean + reg_relevance * reg_term
-    return final_loss
-
-
-def build_rel_w_prod_loss(model_output, target_labels, use_reg=True):
-    """Create the multiplicative term based loss function"""
-    R = build_all_labels_repr()
-    proj1 = tf.diag_part(tf.matmul(model_output, tf.transpose(target_labels)))
-    sum1 = LOSS_MARGIN - proj1
-    relevance_weights = build_relevance_weights(target_labels, R)
-
-    sum2 = tf.matmul(model_output, tf.transpose(R))
-    weighted_sum2 = tf.multiply(sum2, relevance_weights)
-    sum3 = tf.transpose(sum1 + tf.transpose(weighted_sum2))
-    relu_sum3 = tf.nn.relu(sum3)
-    mean = tf.reduce_mean(relu_sum3)
-    reg_term = tf.norm(tf.reduce_mean(model_output, 0) - tf.reduce_mean(R, 0))
-    reg_relevance = 0.2
-    if not use_reg:
-        reg_relevance = 0
-    final_loss = mean + reg_relevance * reg_term
-    return final_loss
-
-
-def build_no_margin_prod_loss(model_output, target_labels):
-    """Created the no margin loss function"""
-    R = build_all_labels_repr()
-    proj1 = tf.diag_part(tf.matmul(model_output, tf.transpose(target_labels)))
-    sum1 = (-1) * proj1
-    sum2 = tf.matmul(model_output, tf.transpose(R))
-    sum3 = tf.transpose(sum1 + tf.transpose(sum2))
-    mean = tf.reduce_mean(sum3)
-    reg_term = tf.norm(tf.reduce_mean(model_output, 0) - tf.reduce_mean(R, 0))
-    variance = tf.pow(tf.reduce_mean(tf.norm(model_output, axis=1)) - tf.reduce_mean(tf.norm(R, axis=1)), 2)
-    reg_term2 = variance
-    final_loss = mean + 0.2 * reg_term + 0.8 * reg_term2
-    return final_loss
-
-
-def build_loss(model_output, target_labels):
-    """Change here which loss function you wish to use"""
-    return build_eucli_loss(model_output, target_labels, use_reg=False)
-
 
 with tf.name_scope("loss"):
-    loss = build_loss(model_output, y)
+    loss = build_loss(args.loss, model_output, y, use_reg=args.use_reg)
 
 with tf.name_scope('train'):
     gradients = tf.gradients(loss, var_list)
@@ -209,9 +89,41 @@ variables_to_restore = [v for v in tf.trainable_variables() if 'proj' not in v.n
 
 previous_loader = tf.train.Saver(variables_to_restore)
 
-# Initalize the data generator seperately for the training and validation set
-train_generator = get_batches(target_train_data, batch_size, IMAGE_SIZE, word2vec=True)
-val_generator = get_batches(target_test_data, batch_size, IMAGE_SIZE, word2vec=True)
+train_label_rows = label_embedding_rows(train_data)
+test_label_rows = label_embedding_rows(test_data)
+
+
+def run_train_epoch(sess):
+    """Runs the training op over the whole training set"""
+    if USE_TF_DATA:
+        input_pipeline.start_epoch(sess, train_data.images, train_label_rows, training=True)
+        while True:
+            try:
+                sess.run(train_op, feed_dict={is_training: True})
+            except tf.errors.OutOfRangeError:
+                break
+    else:
+        for batch_xs, batch_ys in prefetch_batches(train_data, batch_size, IMAGE_SIZE, word2vec=True):
+            # And run the training op
+            sess.run(train_op, feed_dict={x: batch_xs,
+                                          y: batch_ys,
+                                          is_training: True})
+
+
+def validation_losses(sess):
+    """Yields the loss of every batch of the validation set"""
+    if USE_TF_DATA:
+        input_pipeline.start_epoch(sess, test_data.images, test_label_rows, training=False)
+        while True:
+            try:
+                yield sess.run(loss)
+            except tf.errors.OutOfRangeError:
+                break
+    else:
+        for batch_tx, batch_ty in prefetch_batches(test_data, batch_size, IMAGE_SIZE, word2vec=True):
+            yield sess.run(loss, feed_dict={x: batch_tx,
+                                            y: batch_ty})
+
 
 # Start Tensorflow session
 with tf.Session() as sess:
@@ -231,21 +143,14 @@ with tf.Session() as sess:
 
         print_in_file("{} Epoch number: {}".format(datetime.now(), epoch + 1))
 
-        for batch_xs, batch_ys in train_generator:
-            # And run the training op
-            new_batch = sess.run(dist_x_batch, feed_dict={initial_x_batch: batch_xs})
-
-            sess.run(train_op, feed_dict={x: new_batch,
-                                          y: batch_ys})
+        run_train_epoch(sess)
 
         # Validate the model on the entire validation set
         print_in_file("{} Start validation".format(datetime.now()))
         test_loss = 0.
         test_count = 0
 
-        for batch_tx, batch_ty in val_generator:
-            new_loss = sess.run(loss, feed_dict={x: batch_tx,
-                                                 y: batch_ty})
+        for new_loss in validation_losses(sess):
             if math.isnan(new_loss):
                 print('Loss has NaN')
             test_loss += new_loss
@@ -254,10 +159,6 @@ with tf.Session() as sess:
 
         print_in_file("Validation Loss = %s %.4f" % (datetime.now(), test_loss), OUTPUT_FILE_NAME)
 
-        # Reset the file pointer of the image data generator
-        train_generator = get_batches(target_train_data, batch_size, IMAGE_SIZE, word2vec=True)
-        val_generator = get_batches(target_test_data, batch_size, IMAGE_SIZE, word2vec=True)
-
         print_in_file("{} Saving checkpoint of model...".format(datetime.now()), OUTPUT_FILE_NAME)
 
         # save checkpoint of the model
@@ -7,6 +7,7 @@ import os
 from datetime import datetime
 from models import VGG19
 from batch_making import *
+from data_context import context
 from training_utils import *
 
 initial_learning_rate = 0.001
@@ -24,13 +25,13 @@ checkpoint_path = 'checkpoints_vgg/'
 IMAGE_SIZE = 32
 OUTPUT_FILE_NAME = 'train_output_vgg.txt'
 
-decay_steps = int(len(target_train_data)/batch_size)
+decay_steps = int(len(context.target_train_data)/batch_size)
 learning_rate_decay_factor = 0.95
 
 if not os.path.isdir(filewriter_path): os.mkdir(filewriter_path)
 if not os.path.isdir(checkpoint_path): os.mkdir(checkpoint_path)
 
-x = tf.placeholder(tf.float32, [batch_size, IMAGE_SIZE, IMAGE_SIZE, 3])
+x = tf.placeholder(tf.float32, [None, IMAGE_SIZE, IMAGE_SIZE, 3])
 y = tf.placeholder(tf.float32, [None, num_classes])
 keep_prob = tf.placeholder(tf.float32)
 
@@ -40,7 +41,7 @@ score = model.fc8
 var_list = [v for v in tf.trainable_variables()]
 print(var_list)
 
-initial_x_batch = tf.placeholder(tf.float32, [batch_size, IMAGE_SIZE, IMAGE_SIZE, 3])
+initial_x_batch = tf.placeholder(tf.float32, [None, IMAGE_SIZE, IMAGE_SIZE, 3])
 dist_x_batch = distorted_batch(initial_x_batch, IMAGE_SIZE)
 
 with tf.name_scope("cross_ent"):
@@ -69,8 +70,8 @@ with tf.name_scope('accuracy'):
 saver = tf.train.Saver()
 
 # Initalize the data generator seperately for the training and validation set
-train_generator = get_batches(target_train_data, batch_size, IMAGE_SIZE)
-val_generator = get_batches(target_test_data, batch_size, IMAGE_SIZE)
+train_generator = prefetch_batches(context.target_train_data, batch_size, IMAGE_SIZE)
+val_generator = prefetch_batches(context.target_test_data, batch_size, IMAGE_SIZE)
 
 # Start Tensorflow session
 with tf.Session() as sess:
@@ -114,8 +115,8 @@ with tf.Session() as sess:
     print_in_file("Validation Accuracy = %s %.4f" % (datetime.now(), test_acc), OUTPUT_FILE_NAME)
 
     # Reset the file pointer of the image data generator
-    train_generator = get_batches(target_train_data, batch_size, IMAGE_SIZE)
-    val_generator = get_batches(target_test_data, batch_size, IMAGE_SIZE)
+    train_generator = prefetch_batches(context.target_train_data, batch_size, IMAGE_SIZE)
+    val_generator = prefetch_batches(context.target_test_data, batch_size, IMAGE_SIZE)
 
     print_in_file("{} Saving checkpoint of model...".format(datetime.now()), OUTPUT_FILE_NAME)
 
@@ -1,8 +1,9 @@
 import tensorflow as tf
-import pickle
+import numpy as np
 from glove_interface import *
+from data_context import context
+from models import normalize_images
 
-all_labels = pickle.load(open('pickle_files/all_labels.pickle', 'rb'))
 word2vec_size = 200
 
 
@@ -23,6 +24,25 @@ def distorted_batch(batch, image_size):
     return tf.map_fn(lambda frame: distort_image(frame, image_size), batch)
 
 
+def distort_images(batch):
+    """Batched version of distort_image: every frame gets its own random flip, brightness and contrast,
+    but each step is a single op over the whole batch.
+    (The random crop of distort_image is left out: the frames already have the crop size)"""
+    batch_size = tf.shape(batch)[0]
+    flip = tf.random_uniform([batch_size]) < 0.5
+    distorted = tf.where(flip, tf.reverse(batch, axis=[2]), batch)
+    distorted = distorted + tf.random_uniform([batch_size, 1, 1, 1], -63, 63)
+    contrast_factor = tf.random_uniform([batch_size, 1, 1, 1], 0.2, 1.8)
+    channel_means = tf.reduce_mean(distorted, axis=[1, 2], keepdims=True)
+    distorted = (distorted - channel_means) * contrast_factor + channel_means
+    return normalize_images(distorted)
+
+
+def augment_images(batch, is_training):
+    """Distorts the batch when is_training is True, otherwise returns it unchanged"""
+    return tf.cond(is_training, lambda: distort_images(batch), lambda: batch)
+
+
 def print_in_file(string, output_filename):
     """Prints a string into a file"""
     output_file = open(output_filename, 'a')
@@ -33,8 +53,39 @@ def print_in_file(string, output_filename):
 
 def build_all_labels_repr():
     """Creates a matrix with all labels word2vec representations"""
-    all_repr = []
-    for label in all_labels:
-        wv = find_word_vec(normalize_label(label))
-        all_repr.append(wv)
-    return tf.constant(np.array(all_repr), shape=[len(all_labels), word2vec_size], dtype=tf.float32)
+    all_labels = context.all_labels
+    all_repr = context.label_embeddings.vectors(all_labels)
+    return tf.constant(all_repr, shape=[len(all_labels), word2vec_size], dtype=tf.float32)
+
+
+class InputPipeline(object):
+    """tf.data pipeline that shuffles, batches and looks up the label embeddings of a columnar
+    dataset inside the graph. x and y are the (image, label embedding) batches of the epoch
+    started by start_epoch. Augmentation is done in the graph by augment_images"""
+    def __init__(self, batch_size, image_size, label_matrix, num_parallel_calls=4, shuffle_buffer=50000,
+                 prefetch=2):
+        self.images = tf.placeholder(tf.uint8, [None, image_size, image_size, 3])
+        self.label_rows = tf.placeholder(tf.int64, [None])
+        label_matrix = tf.constant(label_matrix, dtype=tf.float32)
+
+        def prepare_sample(image, label_row):
+            return tf.cast(image, tf.float32), tf.gather(label_matrix, label_row)
+
+        samples = tf.data.Dataset.from_tensor_slices((self.images, self.label_rows))
+        train_dataset = samples.shuffle(shuffle_buffer) \
+            .map(prepare_sample, num_parallel_calls=num_parallel_calls) \
+            .batch(batch_size) \
+            .prefetch(prefetch)
+        val_dataset = samples.map(prepare_sample, num_parallel_calls=num_parallel_calls) \
+            .batch(batch_size) \
+            .prefetch(prefetch)
+
+        iterator = tf.data.Iterator.from_structure(train_dataset.output_types, train_dataset.output_shapes)
+        self.train_init = iterator.make_initializer(train_dataset)
+        self.val_init = iterator.make_initializer(val_dataset)
+        self.x, self.y = iterator.get_next()
+
+    def start_epoch(self, sess, images, label_rows, training=True):
+        """Feeds the dataset arrays into the pipeline. Batches are produced until tf.errors.OutOfRangeError"""
+        init = self.train_init if training else self.val_init
+        sess.run(init, feed_dict={self.images: images, self.label_rows: label_rows})
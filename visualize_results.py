@@ -1,19 +1,19 @@
 # Partialy based on https://kratzert.github.io/2017/02/24/finetuning-alexnet-with-tensorflow.html
 
-import tensorflow as tf
 import numpy as np
-import pickle
+import hashlib
+import json
+import multiprocessing
 import os
+import matplotlib
+matplotlib.use('Agg')  # The plots are only saved to files
 import matplotlib.pyplot as plt
-from datetime import datetime
-from models import Composite_model
 from batch_making import *
+from data_context import context
+from sklearn.decomposition import PCA
 from sklearn.manifold import TSNE
-from training_utils import *
 
-batch_size = 128
-num_classes = 60
-word2vec_size = 200
+batch_size = 1024  # Only used for inference, the graph accepts any batch size
 
 IMAGE_SIZE = 24
 CHECKPOINT_TO_LOAD = ''  # Change here
@@ -21,97 +21,146 @@ FOLDER_TO_SAVE = ''  # Change here
 KNOWN_CLASSES = False  # Change here
 ZERO_SHOT_CLASSES = True  # Change here
 
-if CHECKPOINT_TO_LOAD == '' or FOLDER_TO_SAVE == '':
-    print('Please modify the CHECKPOINT_TO_LOAD and FOLDER_TO_SAVE variables')
-
-all_labels = pickle.load(open('pickle_files/all_labels.pickle', 'rb'))
-
-x = tf.placeholder(tf.float32, [batch_size, IMAGE_SIZE, IMAGE_SIZE, 3])
-y = tf.placeholder(tf.float32, [None, word2vec_size])
-
-model = Composite_model(x, num_classes, word2vec_size)
-model_output = model.projection_layer
-
-saver = tf.train.Saver()
-
-data_to_use = []
-
-if KNOWN_CLASSES:
-    data_to_use += target_test_data
-
-if ZERO_SHOT_CLASSES:
-    all_not_target = not_target_train_data + not_target_test_data
-    data_to_use += all_not_target
-
-data_generator = get_batches(data_to_use, batch_size, IMAGE_SIZE, word2vec=True, send_raw_str=True)
-
-points = {}
-for label in all_labels:
-    points[normalize_label(label)] = []
-
-# Start Tensorflow session
-with tf.Session() as sess:
-    # Initialize all variables
-    sess.run(tf.global_variables_initializer())
-
-    # Load the pretrained weights into the non-trainable layer
-    saver.restore(sess, CHECKPOINT_TO_LOAD)
-
-    for batch_x, batch_y, batch_labels in data_generator:
-        output = sess.run(model_output, {x: batch_x})
-        for i, o in enumerate(output):
-            label = normalize_label(batch_labels[i])
-            points[label].append(o)
-
-all_points = []
-points_labels = []
-
-label_points = [find_word_vec(normalize_label(L)) for L in all_labels]
-
-for k in points.keys():
-    for p in points[k]:
-        all_points.append(p)
-        points_labels.append(k)
-
-for i, L in enumerate(all_labels):
-    all_points.append(label_points[i])
-    points_labels.append('LABEL-' + normalize_label(L))
-
-print('RUNNING TSNE')
-manifold = TSNE(n_components=2).fit_transform(all_points)
-print('DONE')
-
-output_points = [a for i, a in enumerate(manifold) if 'LABEL' not in points_labels[i]]
-class_points = [[a, points_labels[i]] for i, a in enumerate(manifold) if 'LABEL' in points_labels[i]]
-
-x_output = [a[0] for a in output_points]
-y_output = [a[1] for a in output_points]
-x_class_points = [a[0][0] for a in class_points]
-y_class_points = [a[0][1] for a in class_points]
-l_class_points = [a[1].split('-')[1] for a in class_points]
-
-
-def make_graph(attention_label):
-    my_graph = plt.scatter(x_class_points, y_class_points)
-    target_point = None
-    for i, L in enumerate(l_class_points):
-        if L == attention_label:
-            target_point = [[x_class_points[i]], [y_class_points[i]]]
-        plt.annotate(L, xy=(x_class_points[i], y_class_points[i]), size=5)
-    return target_point
+POINTS_PER_CLASS = 100  # Stratified sample of each class, None to use every point
+PCA_COMPONENTS = 50  # Reduction before TSNE, None to run TSNE on the raw projections
+TSNE_METHOD = 'barnes_hut'  # 'barnes_hut' or 'exact'
+TSNE_ANGLE = 0.5  # Barnes-Hut speed/accuracy trade-off
+TSNE_PERPLEXITY = 30.0
+LAYOUT_SEED = 0
+RENDER_WORKERS = os.cpu_count() or 1
+PLOT_DPI = 1000
+
+
+def stratified_sample(labels, points_per_class, seed=LAYOUT_SEED):
+    """Returns the (sorted) indices of at most points_per_class random samples of each label"""
+    labels = np.asarray(labels)
+    if points_per_class is None:
+        return np.arange(len(labels))
+    rng = np.random.RandomState(seed)
+    indices = []
+    for label in np.unique(labels):
+        label_indices = np.flatnonzero(labels == label)
+        if len(label_indices) > points_per_class:
+            label_indices = rng.choice(label_indices, points_per_class, replace=False)
+        indices.append(label_indices)
+    return np.sort(np.concatenate(indices))
+
+
+def layout_options():
+    """Parameters that change the 2-D layout, used to key its cache file"""
+    return {'points_per_class': POINTS_PER_CLASS, 'pca_components': PCA_COMPONENTS, 'method': TSNE_METHOD,
+            'angle': TSNE_ANGLE, 'perplexity': TSNE_PERPLEXITY, 'seed': LAYOUT_SEED}
+
+
+def compute_layout(points, options):
+    """Runs the (optionally PCA reduced) TSNE over the points"""
+    if options['pca_components'] is not None and options['pca_components'] < points.shape[1]:
+        points = PCA(n_components=options['pca_components'], random_state=options['seed']).fit_transform(points)
+    tsne = TSNE(n_components=2, method=options['method'], angle=options['angle'],
+                perplexity=options['perplexity'], random_state=options['seed'])
+    return tsne.fit_transform(points)
+
+
+def load_layout(cache_folder, outputs, output_labels, label_points, options):
+    """Returns the sample indices and the 2-D layout of the sampled outputs followed by the label points.
+    The layout is saved next to the cached embeddings it was computed from"""
+    options_hash = hashlib.sha1(json.dumps(options, sort_keys=True).encode()).hexdigest()[:16]
+    layout_file = os.path.join(cache_folder, 'layout_%s.npz' % options_hash)
+    if os.path.isfile(layout_file):
+        layout = np.load(layout_file)
+        return layout['sample'], layout['manifold']
+
+    sample = stratified_sample(output_labels, options['points_per_class'], options['seed'])
+    # Only the sampled rows are read from the memory mapped embeddings
+    all_points = np.concatenate([np.asarray(outputs[sample]), label_points])
+    print('RUNNING TSNE ON %d POINTS' % len(all_points))
+    manifold = compute_layout(all_points, options)
+    print('DONE')
+    np.savez(layout_file, sample=sample, manifold=manifold)
+    return sample, manifold
+
+
+_render = {}
+
+
+def init_render_worker(class_points, class_labels, output_points, output_labels, folder, dpi):
+    """Draws (once per worker) the base figure with the annotated label points"""
+    fig, ax = plt.subplots()
+    ax.scatter(class_points[:, 0], class_points[:, 1])
+    for i, L in enumerate(class_labels):
+        ax.annotate(L, xy=(class_points[i, 0], class_points[i, 1]), size=5)
+    # Same limits for every label, otherwise they would depend on the labels drawn before
+    all_points = np.concatenate([class_points, output_points])
+    margin = 0.05 * (all_points.max(axis=0) - all_points.min(axis=0))
+    ax.set_xlim(all_points[:, 0].min() - margin[0], all_points[:, 0].max() + margin[0])
+    ax.set_ylim(all_points[:, 1].min() - margin[1], all_points[:, 1].max() + margin[1])
+    ax.autoscale(False)
+    _render.update(fig=fig, ax=ax, class_points=class_points, class_labels=list(class_labels),
+                   output_points=output_points, output_labels=np.asarray(output_labels), folder=folder, dpi=dpi)
 
 
 def show_label_points(label):
-    target_point = make_graph(label)
-    wx = [x for i, x in enumerate(x_output) if points_labels[i] == label]
-    wy = [y for i, y in enumerate(y_output) if points_labels[i] == label]
-    plt.scatter(wx, wy, c='red')
-    plt.scatter(target_point[0], target_point[1], c='green')
-    plt.title(label)
-    plt.savefig(os.path.join(FOLDER_TO_SAVE, label + '.png'), format='png', dpi=1000)
-
-
-ls = list(set([label for label in points_labels if 'LABEL-' not in label]))
-for label in ls:
-    plt.close()
-    show_label_points(label)
+    """Adds the points of a label to the base figure, saves it and removes them again"""
+    ax = _render['ax']
+    wxy = _render['output_points'][_render['output_labels'] == label]
+    target_point = _render['class_points'][_render['class_labels'].index(label)]
+    added = [ax.scatter(wxy[:, 0], wxy[:, 1], c='red'), ax.scatter([target_point[0]], [target_point[1]], c='green')]
+    ax.set_title(label)
+    _render['fig'].savefig(os.path.join(_render['folder'], label + '.png'), format='png', dpi=_render['dpi'])
+    for artist in added:
+        artist.remove()
+    return label
+
+
+def render_label_plots(labels, render_args, num_workers=RENDER_WORKERS):
+    """Saves one plot per label, splitting the labels between worker processes"""
+    if num_workers <= 1:
+        init_render_worker(*render_args)
+        return [show_label_points(label) for label in labels]
+    pool = multiprocessing.get_context('spawn').Pool(num_workers, initializer=init_render_worker,
+                                                     initargs=render_args)
+    try:
+        return pool.map(show_label_points, labels)
+    finally:
+        pool.close()
+        pool.join()
+
+
+if __name__ == '__main__':
+    # Imported here so the render workers (which import this file) do not load tensorflow
+    from embedding_cache import EmbeddingExtractor, load_datasets
+
+    if CHECKPOINT_TO_LOAD == '' or FOLDER_TO_SAVE == '':
+        print('Please modify the CHECKPOINT_TO_LOAD and FOLDER_TO_SAVE variables')
+
+    all_labels = context.all_labels
+
+    dataset_names = []
+
+    if KNOWN_CLASSES:
+        dataset_names.append('target_test_data')
+
+    if ZERO_SHOT_CLASSES:
+        dataset_names += ['not_target_train_data', 'not_target_test_data']
+
+    if not dataset_names:
+        raise SystemExit('Please set KNOWN_CLASSES and/or ZERO_SHOT_CLASSES to True')
+
+    data_to_use, data_to_use_name = load_datasets(dataset_names, IMAGE_SIZE)
+
+    extractor = EmbeddingExtractor(IMAGE_SIZE, batch_size)
+    outputs, output_labels = extractor.embeddings(CHECKPOINT_TO_LOAD, data_to_use_name, data_to_use)
+    extractor.close()
+    output_labels = [normalize_label(L) for L in output_labels]
+
+    label_points = context.label_embeddings.vectors(all_labels)
+    cache_folder = extractor.cache_path(CHECKPOINT_TO_LOAD, data_to_use_name, data_to_use)
+    sample, manifold = load_layout(cache_folder, outputs, output_labels, label_points, layout_options())
+
+    output_points = manifold[:len(sample)]
+    class_points = manifold[len(sample):]
+    sample_labels = np.array(output_labels)[sample]
+    class_labels = [normalize_label(L) for L in all_labels]
+
+    ls = sorted(set(sample_labels.tolist()))
+    render_label_plots(ls, (class_points, class_labels, output_points, sample_labels, FOLDER_TO_SAVE, PLOT_DPI))
@@ -0,0 +1,106 @@
+# Load generator for zero_shot_server. Several client threads send /classify requests
+# back to back and the latency percentiles and throughput are reported.
+import argparse
+import http.client
+import io
+import socket
+import threading
+import time
+import numpy as np
+
+# Same defaults as zero_shot_server, not imported so the client does not load tensorflow
+DEFAULT_PORT = 8500
+DEFAULT_TOP_K = 5
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a Unix socket"""
+    def __init__(self, path):
+        http.client.HTTPConnection.__init__(self, 'localhost')
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+def make_connection(host, port, unix_socket=None):
+    if unix_socket:
+        return UnixHTTPConnection(unix_socket)
+    return http.client.HTTPConnection(host, port)
+
+
+def encode_images(images):
+    """.npy body of an image batch"""
+    buffer = io.BytesIO()
+    np.save(buffer, images, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def client(connection, bodies, k, latencies, errors):
+    """Sends the requests one after the other over a keep-alive connection"""
+    for body in bodies:
+        start = time.time()
+        connection.request('POST', '/classify?k=%d' % k, body, {'Content-Type': 'application/x-npy'})
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.time() - start)
+        if response.status != 200:
+            errors.append(response.status)
+
+
+def run_load_test(host, port, unix_socket, concurrency, num_requests, images_per_request, image_size,
+                  k=DEFAULT_TOP_K, seed=0):
+    """Sends num_requests requests from concurrency threads. Returns the latency and throughput stats"""
+    rng = np.random.RandomState(seed)
+    bodies = [encode_images(rng.randint(0, 256, (images_per_request, image_size, image_size, 3)).astype(np.uint8))
+              for i in range(min(num_requests, 64))]
+    requests = [bodies[i % len(bodies)] for i in range(num_requests)]
+
+    # One warm up request so the first projection call is not measured
+    connection = make_connection(host, port, unix_socket)
+    client(connection, requests[:1], k, [], [])
+    connection.close()
+
+    latencies = []
+    errors = []
+    connections = [make_connection(host, port, unix_socket) for i in range(concurrency)]
+    threads = [threading.Thread(target=client, args=(connections[i], requests[i::concurrency], k, latencies, errors))
+               for i in range(concurrency)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    for c in connections:
+        c.close()
+
+    latencies = np.array(latencies)
+    return {'requests': len(latencies), 'errors': len(errors),
+            'p50': np.percentile(latencies, 50), 'p99': np.percentile(latencies, 99), 'mean': np.mean(latencies),
+            'requests_per_second': len(latencies) / elapsed,
+            'images_per_second': len(latencies) * images_per_request / elapsed}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test of the zero-shot classification service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--unix-socket')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--images-per-request', type=int, default=1)
+    parser.add_argument('--image-size', type=int, default=32, help='Size of the random images sent')
+    parser.add_argument('--top-k', type=int, default=DEFAULT_TOP_K)
+    args = parser.parse_args()
+
+    print('%12s %9s %7s %10s %10s %10s %12s %12s' % ('concurrency', 'requests', 'errors', 'p50 (ms)', 'p99 (ms)',
+                                                    'mean (ms)', 'requests/s', 'images/s'))
+    for concurrency in args.concurrency:
+        r = run_load_test(args.host, args.port, args.unix_socket, concurrency, args.requests,
+                          args.images_per_request, args.image_size, args.top_k)
+        print('%12d %9d %7d %10.2f %10.2f %10.2f %12.1f %12.1f' % (concurrency, r['requests'], r['errors'],
+                                                                   1000 * r['p50'], 1000 * r['p99'],
+                                                                   1000 * r['mean'], r['requests_per_second'],
+                                                                   r['images_per_second']))
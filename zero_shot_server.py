@@ -0,0 +1,308 @@
+# HTTP (or Unix socket) service that classifies images against the label vocabulary.
+# The model is loaded once; a batcher thread groups the images of concurrent requests into a
+# single projection call (up to max_batch_size images or max_wait seconds after the first
+# request) and ranks the projections against the precomputed label matrix.
+#
+# POST /classify?k=5 with a .npy body holding a uint8 (height, width, 3) image or a
+# (N, height, width, 3) batch (any size, resized to the model size), or with a PNG/JPEG file.
+# The answer is {"predictions": [[{"label": ..., "score": ...}, ...], ...]}, one list per image,
+# where score is the cosine similarity between the projection and the label.
+import argparse
+import io
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+from batch_making import adjust_batch
+from quantitative_utils import get_label_ranker, get_vocabulary_index
+from label_index import top_k_indices
+from embedding_cache import build_projection_graph, IMAGE_SIZE
+
+DEFAULT_PORT = 8500
+MAX_BATCH_SIZE = 256
+MAX_WAIT = 0.005  # Seconds the batcher waits for more requests after the first one
+DEFAULT_TOP_K = 5
+MAX_TOP_K = 100
+MAX_BODY_SIZE = 64 * 2 ** 20  # Bytes, larger /classify bodies are rejected with 413
+
+
+class CheckpointProjector(object):
+    """Projects image batches with a composite model checkpoint, a frozen inference graph (.pb),
+    an int8 TensorFlow Lite model (.tflite, see quantize_model) or numpy weights (.npz, see numpy_inference)"""
+    def __init__(self, model_file, image_size=IMAGE_SIZE, max_batch_size=MAX_BATCH_SIZE):
+        self.image_size = image_size
+        self.sess = None
+        self.model = None  # Projector not run in a tensorflow session (.tflite or .npz)
+        if model_file.endswith('.tflite'):
+            from quantize_model import TFLiteProjector
+            self.model = TFLiteProjector(model_file, batch_size=max_batch_size)
+        elif model_file.endswith('.npz'):
+            from numpy_inference import NumpyProjector
+            self.model = NumpyProjector(model_file, image_size)
+        elif model_file.endswith('.pb'):
+            from export_inference_graph import load_inference_graph
+            self.graph, self.x, self.projection = load_inference_graph(model_file)
+            self.sess = tf.Session(graph=self.graph)
+        else:
+            self.graph = tf.Graph()
+            with self.graph.as_default():
+                self.x, self.projection, saver = build_projection_graph(image_size)
+            self.sess = tf.Session(graph=self.graph)
+            saver.restore(self.sess, model_file)
+
+    def __call__(self, images):
+        images = adjust_batch(images, self.image_size)
+        if self.model is not None:
+            return self.model(images)
+        return self.sess.run(self.projection, {self.x: images})
+
+    def close(self):
+        if self.sess is not None:
+            self.sess.close()
+
+
+class LabelScorer(object):
+    """Ranks projections against the dataset labels (or a glove vocabulary index)"""
+    def __init__(self, zero_shot_only=False, vocabulary_size=None, backend='exact'):
+        if vocabulary_size:
+            self.index = get_vocabulary_index(vocabulary_size, backend)
+            self.ranker = None
+        else:
+            self.ranker = get_label_ranker(zero_shot_only)
+            self.index = None
+
+    def top_k(self, outputs, k):
+        """Returns the (batch, k) label names and cosine similarities, the most similar first"""
+        if self.index is not None:
+            indices, distances = self.index.search(outputs, k)
+            return self.index.words[indices], 1 - distances
+        distances = self.ranker.distances(outputs, metric='cosine')
+        indices = top_k_indices(distances, k)
+        return self.ranker.label_names[indices], 1 - np.take_along_axis(distances, indices, axis=1)
+
+
+class MicroBatcher(object):
+    """Thread that runs the projection and ranking over groups of pending requests"""
+    def __init__(self, projector, scorer, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_WAIT):
+        self.projector = projector
+        self.scorer = scorer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.pending = None  # Request that did not fit in the previous group
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, images, k):
+        """Queues a (N, height, width, 3) batch. Returns a Future with its (labels, scores)"""
+        future = Future()
+        self.requests.put((images, k, future))
+        return future
+
+    def next_group(self):
+        """Waits for a request, then gathers the ones arriving within max_wait, up to max_batch_size images.
+        A request that would exceed max_batch_size starts the next group"""
+        group = [self.pending if self.pending is not None else self.requests.get()]
+        self.pending = None
+        num_images = len(group[0][0])
+        deadline = time.time() + self.max_wait
+        while num_images < self.max_batch_size:
+            try:
+                request = self.requests.get(timeout=max(deadline - time.time(), 0))
+            except queue.Empty:
+                break
+            if num_images + len(request[0]) > self.max_batch_size:
+                self.pending = request
+                break
+            group.append(request)
+            num_images += len(request[0])
+        return group
+
+    def top_k(self, image_batches, k):
+        """Projects and ranks the image batches in chunks of at most max_batch_size images,
+        so a single large request never reaches the projector or the scorer at once"""
+        labels = []
+        scores = []
+        # Requests of different image sizes are resized separately
+        for images in concatenate_same_size(image_batches):
+            for i in range(0, len(images), self.max_batch_size):
+                chunk_labels, chunk_scores = self.scorer.top_k(self.projector(images[i:i + self.max_batch_size]), k)
+                labels.append(chunk_labels)
+                scores.append(chunk_scores)
+        return np.concatenate(labels), np.concatenate(scores)
+
+    def run(self):
+        while True:
+            group = self.next_group()
+            try:
+                labels, scores = self.top_k([g[0] for g in group], max(g[1] for g in group))
+            except Exception as e:
+                for _, _, future in group:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for images, k, future in group:
+                end = start + len(images)
+                future.set_result((labels[start:end, :k], scores[start:end, :k]))
+                start = end
+
+
+def concatenate_same_size(image_batches):
+    """Joins consecutive batches of the same image shape, keeping the order"""
+    joined = []
+    for images in image_batches:
+        if joined and joined[-1][0].shape[1:] == images.shape[1:]:
+            joined[-1].append(images)
+        else:
+            joined.append([images])
+    return [np.concatenate(batches) for batches in joined]
+
+
+def decode_images(body, content_type):
+    """Returns the (N, height, width, 3) uint8 batch of a request body"""
+    if content_type == 'application/x-npy':
+        images = np.load(io.BytesIO(body), allow_pickle=False)
+    else:
+        images = np.asarray(Image.open(io.BytesIO(body)).convert('RGB'))
+    if images.ndim == 3:
+        images = images[np.newaxis]
+    if images.ndim != 4 or images.shape[3] != 3 or len(images) == 0:
+        raise ValueError('Expected a (height, width, 3) image or a (N, height, width, 3) batch, got %s' %
+                         (images.shape,))
+    return images
+
+
+class ZeroShotHandler(BaseHTTPRequestHandler):
+    """Handles /classify, /labels and /health. The server holds the batcher"""
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        # The headers and body are written separately, without TCP_NODELAY every answer
+        # would wait for the client's delayed ack (Unix sockets have no such option)
+        self.disable_nagle_algorithm = isinstance(self.client_address, tuple)
+        BaseHTTPRequestHandler.setup(self)
+
+    def send_json(self, status, content, close=False):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if close:
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        elif path == '/labels':
+            scorer = self.server.batcher.scorer
+            labels = scorer.index.words if scorer.index is not None else scorer.ranker.label_names
+            self.send_json(200, {'labels': labels.tolist()})
+        else:
+            self.send_json(404, {'error': 'unknown path %s' % path})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        # An unread body would be parsed as the next request, so the connection is closed
+        if length < 0:
+            self.send_json(400, {'error': 'invalid Content-Length'}, close=True)
+            return
+        if length > self.server.max_body_size:
+            self.send_json(413, {'error': 'body larger than %d bytes' % self.server.max_body_size}, close=True)
+            return
+        body = self.rfile.read(length)
+        if url.path != '/classify':
+            self.send_json(404, {'error': 'unknown path %s' % url.path})
+            return
+        try:
+            k = int(parse_qs(url.query).get('k', [DEFAULT_TOP_K])[0])
+            if not 0 < k <= MAX_TOP_K:
+                raise ValueError('k should be between 1 and %d' % MAX_TOP_K)
+            images = decode_images(body, self.headers.get('Content-Type'))
+        except Exception as e:
+            self.send_json(400, {'error': str(e)})
+            return
+
+        try:
+            labels, scores = self.server.batcher.submit(images, k).result()
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+            return
+        self.send_json(200, {'predictions': [[{'label': L, 'score': float(s)} for L, s in zip(ls, ss)]
+                                             for ls, ss in zip(labels.tolist(), scores)]})
+
+    def address_string(self):
+        # Unix socket clients have no (host, port) address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(batcher, port=DEFAULT_PORT, host='127.0.0.1', unix_socket=None, verbose=False,
+                max_body_size=MAX_BODY_SIZE):
+    """Creates the (not yet serving) HTTP server, listening on a TCP port or on a Unix socket"""
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = ThreadingUnixHTTPServer(unix_socket, ZeroShotHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), ZeroShotHandler)
+    server.batcher = batcher
+    server.verbose = verbose
+    server.max_body_size = max_body_size
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Zero-shot classification service')
+    parser.add_argument('model', help='Composite model checkpoint, frozen inference graph (.pb) '
+                                      'int8 model (.tflite) or numpy weights (.npz)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--unix-socket', help='Listen on this Unix socket instead of a TCP port')
+    parser.add_argument('--image-size', type=int, default=IMAGE_SIZE)
+    parser.add_argument('--max-batch-size', type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument('--max-wait-ms', type=float, default=1000 * MAX_WAIT)
+    parser.add_argument('--max-body-mb', type=float, default=MAX_BODY_SIZE / 2.0 ** 20,
+                        help='Larger request bodies are rejected with 413')
+    parser.add_argument('--zero-shot-only', action='store_true', help='Rank only the zero shot labels')
+    parser.add_argument('--vocabulary-size', type=int,
+                        help='Rank against this many glove words instead of the dataset labels')
+    parser.add_argument('--index-backend', default='exact', choices=['exact', 'ivf'])
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    projector = CheckpointProjector(args.model, args.image_size, args.max_batch_size)
+    scorer = LabelScorer(args.zero_shot_only, args.vocabulary_size, args.index_backend)
+    batcher = MicroBatcher(projector, scorer, args.max_batch_size, args.max_wait_ms / 1000.0)
+    server = make_server(batcher, args.port, args.host, args.unix_socket, args.verbose,
+                         int(args.max_body_mb * 2 ** 20))
+    print('SERVING ON', args.unix_socket or '%s:%d' % (args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        projector.close()